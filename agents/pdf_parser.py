@@ -6,14 +6,14 @@ import fitz  # PyMuPDF
 import json
 from typing import Dict, List, Optional
 from pathlib import Path
-from openai import OpenAI
+from llm.client import get_openai_client
 from rules.schemas.report import PDFExtraction
 
 class PDFParser:
     """Parse diabetes lab reports from PDF files"""
     
     def __init__(self, api_key: str = None):
-        self.client = OpenAI(api_key=api_key or os.getenv('OPENAI_API_KEY'))
+        self.client = get_openai_client(api_key)
         self.model = "gpt-4o-mini"
         
     def extract_text(self, pdf_file) -> tuple[str, Dict]:
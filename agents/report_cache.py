@@ -0,0 +1,122 @@
+"""
+Persistent content-addressed cache of validated LLM reports
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from rules.schemas.report import ReportOut
+
+
+def canonical_hash(value: Any) -> str:
+    """sha256 of a canonical JSON rendering (sorted keys, dates as strings)"""
+    text = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def report_cache_key(patient_intake: Dict, rules: Dict, snippets: List[Dict], prompt: str,
+                     model: str, temperature: float, max_tokens: int,
+                     precomputed_sections: Dict = None) -> str:
+    """
+    Key for one report generation: everything that shapes the LLM input
+
+    Rules and prompt are hashed by content, so editing either one
+    invalidates earlier entries without a manual version bump. Snippets
+    contribute their ids in order plus their text. Precomputed sections
+    are sent to the LLM, so they are part of the key too: when a
+    screening becomes overdue the narrative is regenerated to match. The
+    patient uuid is left out: it names the record but never changes the
+    report.
+    """
+    return canonical_hash({
+        "patient_intake": {k: v for k, v in patient_intake.items() if k != 'uuid'},
+        "rules_version": canonical_hash(rules),
+        "snippets": [(snippet.get('id'), snippet.get('text_hash') or snippet.get('text'))
+                     for snippet in snippets],
+        "prompt_version": canonical_hash(prompt),
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "precomputed_sections": precomputed_sections or {},
+    })
+
+
+class ReportCache:
+    """
+    SQLite store of ReportOut JSON keyed by report_cache_key
+
+    Entries older than max_age_days are dropped, and once the store
+    exceeds max_mb the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str = "data/cache/report_cache.sqlite",
+                 max_mb: float = None, max_age_days: float = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int((max_mb if max_mb is not None
+                              else float(os.getenv('REPORT_CACHE_MAX_MB', '50'))) * 1024 * 1024)
+        self.max_age = (max_age_days if max_age_days is not None
+                        else float(os.getenv('REPORT_CACHE_MAX_AGE_DAYS', '30'))) * 86400
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS reports (
+                    key TEXT PRIMARY KEY,
+                    report TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )"""
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.path), timeout=30)
+
+    def get(self, key: str) -> Optional[ReportOut]:
+        """Cached report for the key, or None if missing or expired"""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT report, created_at FROM reports WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.max_age:
+                conn.execute("DELETE FROM reports WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE reports SET last_used = ? WHERE key = ?", (now, key))
+        return ReportOut(**json.loads(row[0]))
+
+    def put(self, key: str, report: ReportOut):
+        """Store a validated report, then apply age and size eviction"""
+        data = json.dumps(report.dict(), ensure_ascii=False, default=str)
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO reports (key, report, size, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data.encode('utf-8')), now, now)
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM reports WHERE created_at < ?", (now - self.max_age,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM reports").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute(
+            "SELECT key, size FROM reports ORDER BY last_used ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM reports WHERE key = ?", (key,))
+            total -= size
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM reports")
@@ -1,27 +1,115 @@
 """
-Report orchestrator for single-pass LLM report generation
+Report orchestrator for LLM report generation (single-pass or sectional)
 """
 import json
 import os
-from typing import Dict, List, Optional, Tuple
+from concurrent.futures import as_completed
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from datetime import datetime
 from pathlib import Path
-from openai import OpenAI
+from pydantic import TypeAdapter, ValidationError
 
 from rules.schemas.report import PatientIntake, ReportOut
+from agents.report_cache import ReportCache, report_cache_key
 from rag.retriever import RAGRetriever
 from rules import load_rules
-from llm.prompts import get_report_generation_prompt
+from rules.sections import PRECOMPUTED_SECTIONS, precompute_sections
+from llm.client import api_key_checked, get_async_openai_client, get_openai_client, submit_async
+from llm.json_stream import TopLevelJSONParser
+from llm.prompt_builder import PromptBuilder
+from llm.prompts import (
+    REPORT_SECTION_GROUPS, get_report_generation_prompt, get_section_generation_prompt
+)
 from utils.formatters import normalize_patient_data
 
+# Section groups the LLM still generates in sectional mode
+_NARRATIVE_SECTION_GROUPS = {
+    name: narrative
+    for name, sections in REPORT_SECTION_GROUPS.items()
+    if (narrative := [section for section in sections if section not in PRECOMPUTED_SECTIONS])
+}
+
+# Sections the LLM generates in single-pass mode
+_NARRATIVE_SECTIONS = tuple(name for name in ReportOut.model_fields if name not in PRECOMPUTED_SECTIONS)
+
+# Per-field validators so streamed sections are checked before display
+_SECTION_VALIDATORS = {
+    name: TypeAdapter(field.annotation) for name, field in ReportOut.model_fields.items()
+}
+
+@lru_cache(maxsize=None)
+def _response_format(sections: Tuple[str, ...]) -> Dict:
+    """JSON-schema response format for these ReportOut sections"""
+    schema = ReportOut.model_json_schema()
+    section_schema = {
+        "type": "object",
+        "properties": {name: schema["properties"][name] for name in sections},
+        "required": list(sections),
+    }
+    if "$defs" in schema:
+        section_schema["$defs"] = schema["$defs"]
+    # Not strict: the free-form Dict sections cannot meet strict-mode rules
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": "report_sections", "schema": section_schema, "strict": False},
+    }
+
+def _cited_ids(value) -> set:
+    """Every citation_ids entry anywhere inside a section value"""
+    cited = set()
+    if isinstance(value, dict):
+        cited.update(value.get('citation_ids') or [])
+        for item in value.values():
+            cited |= _cited_ids(item)
+    elif isinstance(value, list):
+        for item in value:
+            cited |= _cited_ids(item)
+    return cited
+
+def _parse_json_reply(result_text: str) -> Dict:
+    """Parse a JSON completion, tolerating a ```json fence"""
+    result_text = result_text.strip()
+    
+    # Clean and parse JSON
+    if result_text.startswith('```json'):
+        result_text = result_text[7:]
+    if result_text.endswith('```'):
+        result_text = result_text[:-3]
+    
+    return json.loads(result_text)
+
+class ReportRepairError(ValueError):
+    """Sections still invalid after their repairs; regenerating the whole report would not help"""
+
+
 class ReportOrchestrator:
-    """Orchestrate single-pass report generation with RAG"""
+    """
+    Orchestrate report generation with RAG (single-pass or sectional)
+
+    An instance holds no per-request state, so one orchestrator (with its
+    pooled client, loaded FAISS index and rules) can be shared by every
+    Streamlit session and called from several threads at once.
+    """
     
-    def __init__(self, api_key: str = None):
-        self.client = OpenAI(api_key=api_key or os.getenv('OPENAI_API_KEY'))
+    def __init__(self, api_key: str = None, mode: str = None):
+        self.api_key = api_key
+        self.client = get_openai_client(api_key)
+        self.async_client = get_async_openai_client(api_key)
+        # 'single' (one completion) or 'sectional' (section groups in parallel)
+        self.mode = mode or os.getenv('REPORT_GENERATION_MODE', 'single')
         self.model = "gpt-4o-mini"
-        self.rag_retriever = RAGRetriever()
+        self.temperature = 0.2
+        self.max_tokens = 4000
+        # Output budget for re-requesting only the sections that failed
+        self.repair_max_tokens = 1500
+        # Ask for JSON-schema structured output (REPORT_STRUCTURED_OUTPUT=0
+        # for endpoints without it)
+        self.structured_output = os.getenv('REPORT_STRUCTURED_OUTPUT', '1') != '0'
+        self.rag_retriever = RAGRetriever(api_key=api_key)
         self.rules = load_rules()
+        self.report_cache = ReportCache()
+        self.prompt_builder = PromptBuilder()
         
     def merge_data_sources(self, form_data: Dict, pdf_data: Dict, conflicts: Dict) -> PatientIntake:
         """
@@ -49,42 +137,60 @@ class ReportOrchestrator:
         
         return PatientIntake(**normalized_data)
     
-    def generate_report(self, patient_data: PatientIntake, max_retries: int = 1) -> Tuple[Optional[ReportOut], List[str]]:
+    def generate_report(self, patient_data: PatientIntake, max_retries: int = 1,
+                        use_cache: bool = True, stream: bool = False):
         """
         Generate complete report using single LLM call
         
+        Reports are cached by a hash of everything that shapes the LLM
+        input (patient data, rules, precomputed sections, snippets,
+        prompt, model settings), so a repeat request skips the call.
+        use_cache=False always calls the LLM and refreshes the cached
+        entry.
+        
+        With stream=True this returns an iterator of events instead (see
+        _generate_report_stream), so sections can be shown as they arrive.
+        
+        labs_table, snapshot and screening_tracker are computed from the
+        rules before the call (rules.sections) and the LLM is asked only
+        for the narrative sections.
+        
+        Sections that are missing, fail validation or cite unknown
+        snippets are re-requested on their own (up to max_retries
+        repairs); the whole report is regenerated only when the reply
+        cannot be parsed at all.
+        
         Returns:
             - ReportOut object if successful, None if failed
             - List of error messages
         """
+        if stream:
+            return self._generate_report_stream(patient_data, max_retries, use_cache)
+        
         errors = []
         
         try:
-            # Build retrieval query and get relevant snippets
-            query = self.rag_retriever.build_retrieval_query(patient_data.dict())
-            snippets = self.rag_retriever.retrieve(query, k=6)
-            
-            # Prepare context for LLM
-            context = {
-                "patient_intake": patient_data.dict(),
-                "rules": self.rules,
-                "retrieved_snippets": snippets
-            }
+            context, snippets, cache_key = self._prepare_context(patient_data)
+            errors.extend(context["prompt_warnings"])
+            if use_cache:
+                cached = self.report_cache.get(cache_key)
+                if cached is not None:
+                    return cached, errors
             
             # Generate report with retry logic
             for attempt in range(max_retries + 1):
                 try:
-                    report_json = self._call_llm_for_report(context)
-                    
-                    # Validate and parse
-                    report = ReportOut(**report_json)
-                    
-                    # Validate citations
-                    if not self._validate_citations(report, snippets):
-                        errors.append("Some citations are invalid")
-                    
+                    if self.mode == 'sectional':
+                        report_json = dict(self._sectional_sections(context))
+                    else:
+                        report_json = self._call_llm_for_report(context)
+                    report_json.update(context["precomputed_sections"])
+                    report = self._finalize_report(report_json, context, cache_key, errors, max_retries)
                     return report, errors
                     
+                except ReportRepairError as e:
+                    errors.append(str(e))
+                    return None, errors
                 except Exception as e:
                     error_msg = f"Attempt {attempt + 1} failed: {str(e)}"
                     errors.append(error_msg)
@@ -101,26 +207,222 @@ class ReportOrchestrator:
         
         return None, errors
     
-    def _call_llm_for_report(self, context: Dict) -> Dict:
-        """Call LLM with structured prompt for report generation"""
+    def _generate_report_stream(self, patient_data: PatientIntake, max_retries: int,
+                                use_cache: bool) -> Iterator[Dict]:
+        """
+        Stream report generation as events
         
-        prompt = get_report_generation_prompt()
+        Yields {"type": "section", "name", "value"} for each top-level
+        ReportOut field as soon as it is complete in the token stream and
+        passes that field's validation and citation check, then one final
+        {"type": "report", "report", "errors"} (report is None on failure).
+        Precomputed sections come first, before the LLM call. Sections
+        that fail either check are held back, repaired and sent before the
+        report event. A retry after a failed attempt sends its generated
+        sections again.
+        """
+        errors = []
+        try:
+            context, snippets, cache_key = self._prepare_context(patient_data)
+        except Exception as e:
+            errors.append(f"Report generation failed: {str(e)}")
+            yield {"type": "report", "report": None, "errors": errors}
+            return
+        errors.extend(context["prompt_warnings"])
         
-        # Format context as structured input
-        context_str = f"""
-PATIENT DATA:
-{json.dumps(context['patient_intake'], indent=2)}
-
-CLINICAL RULES:
-{json.dumps(context['rules'], indent=2)}
-
-RETRIEVED EVIDENCE:
-{json.dumps(context['retrieved_snippets'], indent=2)}
-"""
+        if use_cache:
+            cached = self.report_cache.get(cache_key)
+            if cached is not None:
+                for name in ReportOut.model_fields:
+                    yield {"type": "section", "name": name, "value": getattr(cached, name)}
+                yield {"type": "report", "report": cached, "errors": errors}
+                return
+        
+        for name, value in context["precomputed_sections"].items():
+            yield {"type": "section", "name": name, "value": value}
+        
+        snippet_ids = {snippet['id'] for snippet in snippets}
+        for attempt in range(max_retries + 1):
+            try:
+                report_json = dict(context["precomputed_sections"])
+                sent = set()
+                sections = (self._sectional_sections(context) if self.mode == 'sectional'
+                            else self._stream_llm_sections(context))
+                for name, value in sections:
+                    if name in PRECOMPUTED_SECTIONS:
+                        continue
+                    report_json[name] = value
+                    if name in _SECTION_VALIDATORS:
+                        # Held back until _finalize_report has repaired it
+                        if self._section_problem(name, value, snippet_ids):
+                            continue
+                        value = _SECTION_VALIDATORS[name].validate_python(value)
+                    sent.add(name)
+                    yield {"type": "section", "name": name, "value": value}
+                
+                report = self._finalize_report(report_json, context, cache_key, errors, max_retries)
+                for name in _NARRATIVE_SECTIONS:
+                    if name not in sent:
+                        yield {"type": "section", "name": name, "value": getattr(report, name)}
+                yield {"type": "report", "report": report, "errors": errors}
+                return
+                
+            except ReportRepairError as e:
+                errors.append(str(e))
+                yield {"type": "report", "report": None, "errors": errors}
+                return
+            except Exception as e:
+                errors.append(f"Attempt {attempt + 1} failed: {str(e)}")
+                if attempt == max_retries:
+                    yield {"type": "report", "report": None, "errors": errors}
+                    return
+                context["previous_error"] = str(e)
+    
+    def _prepare_context(self, patient_data: PatientIntake) -> Tuple[Dict, List[Dict], str]:
+        """
+        Retrieve evidence and build the LLM context and its cache key
+        
+        The returned snippets are those that fit the prompt token budget;
+        citations are validated against them.
+        """
+        # Build retrieval query and get relevant snippets
+        query = self.rag_retriever.build_retrieval_query(patient_data.dict())
+        snippets = self.rag_retriever.retrieve(query, k=6)
+        
+        # Prepare context for LLM
+        context = {
+            "patient_intake": patient_data.dict(),
+            "rules": self.rules,
+            "retrieved_snippets": snippets,
+            "precomputed_sections": precompute_sections(patient_data.dict(), self.rules)
+        }
+        
+        prompt_input = self.prompt_builder.build(context)
+        snippets = prompt_input.snippets
+        context["retrieved_snippets"] = snippets
+        context["prompt_input"] = prompt_input.text
+        context["prompt_warnings"] = prompt_input.warnings
+        print("Report prompt tokens (system prompt not counted): " + ", ".join(
+            f"{name} {count}" for name, count in prompt_input.token_counts.items()
+        ))
+        
+        if self.mode == 'sectional':
+            prompt = "\n".join(get_section_generation_prompt(sections, PRECOMPUTED_SECTIONS)
+                               for sections in _NARRATIVE_SECTION_GROUPS.values())
+        else:
+            prompt = get_report_generation_prompt(PRECOMPUTED_SECTIONS)
+        cache_key = report_cache_key(
+            context["patient_intake"], self.rules, snippets, prompt,
+            self.model, self.temperature, self.max_tokens, context["precomputed_sections"]
+        )
+        return context, snippets, cache_key
+    
+    def _finalize_report(self, report_json: Dict, context: Dict, cache_key: str,
+                         errors: List[str], max_repairs: int = 1) -> ReportOut:
+        """
+        Repair invalid sections, validate the report and its citations; cache it if clean
+        
+        Sections that only cite unknown snippets after max_repairs are kept
+        and reported in errors; missing or malformed ones raise
+        ReportRepairError, which callers do not retry as a full generation.
+        """
+        snippets = context["retrieved_snippets"]
+        invalid = self._invalid_sections(report_json, snippets)
+        for _ in range(max_repairs):
+            if not invalid:
+                break
+            errors.append(f"Repairing sections: {', '.join(invalid)}")
+            report_json.update(self._repair_sections(context, invalid))
+            invalid = self._invalid_sections(report_json, snippets)
+        
+        if invalid:
+            errors.append("Sections still invalid after repair: "
+                          + "; ".join(f"{name}: {problem}" for name, problem in invalid.items()))
+        try:
+            report = ReportOut(**report_json)
+        except ValidationError as e:
+            raise ReportRepairError(
+                f"Report incomplete after {max_repairs} repair(s): {', '.join(invalid) or str(e)}"
+            ) from e
+        
+        # Validate citations
+        if not self._validate_citations(report, snippets):
+            errors.append("Some citations are invalid")
+        else:
+            # Only fully validated reports are reused
+            self.report_cache.put(cache_key, report)
+        return report
+    
+    @staticmethod
+    def _invalid_sections(report_json: Dict, snippets: List[Dict]) -> Dict[str, str]:
+        """Problem description for each missing, malformed or wrongly cited section"""
+        snippet_ids = {snippet['id'] for snippet in snippets}
+        problems = {}
+        for name in _SECTION_VALIDATORS:
+            if name not in report_json:
+                problems[name] = "missing"
+                continue
+            problem = ReportOrchestrator._section_problem(name, report_json[name], snippet_ids)
+            if problem:
+                problems[name] = problem
+        return problems
+    
+    @staticmethod
+    def _section_problem(name: str, value: Any, snippet_ids: set) -> Optional[str]:
+        """Why one section fails validation or cites unknown snippets, or None if it is sound"""
+        try:
+            _SECTION_VALIDATORS[name].validate_python(value)
+        except ValidationError as e:
+            return f"invalid ({e.errors()[0]['msg']})"
+        if name == 'citations':
+            cited = {cite.get('id') for cite in value if isinstance(cite, dict)}
+        else:
+            cited = _cited_ids(value)
+        unknown = cited - snippet_ids
+        if unknown:
+            return f"cites unknown snippet ids {sorted(map(str, unknown))}"
+        return None
+    
+    def _repair_sections(self, context: Dict, problems: Dict[str, str]) -> Dict:
+        """Re-request only the failed sections; returns the replacement sections"""
+        sections = [name for name in _NARRATIVE_SECTIONS if name in problems]
+        if not sections:
+            return {}
+        messages = self._build_messages(context, get_section_generation_prompt(sections, PRECOMPUTED_SECTIONS))
+        messages.append({
+            "role": "user",
+            "content": "These sections failed validation: "
+                       + "; ".join(f"{name}: {problems[name]}" for name in sections)
+                       + f". Valid citation ids: {[snippet['id'] for snippet in context['retrieved_snippets']]}."
+                       + " Return JSON with only these keys."
+        })
+        
+        with api_key_checked(self.api_key):
+            response = self.client.chat.completions.create(
+                messages=messages, **self._completion_options(sections, self.repair_max_tokens)
+            )
+        repaired = _parse_json_reply(response.choices[0].message.content)
+        return {name: repaired[name] for name in sections if name in repaired}
+    
+    def _completion_options(self, sections, max_tokens: int = None) -> Dict:
+        """Model settings for a completion returning these sections"""
+        options = {
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": max_tokens or self.max_tokens,
+        }
+        if self.structured_output:
+            # Sent as a raw body field: the pinned SDK has no response_format argument
+            options["extra_body"] = {"response_format": _response_format(tuple(sections))}
+        return options
+    
+    def _build_messages(self, context: Dict, prompt: str = None) -> List[Dict]:
+        """System prompt plus the compact, token-budgeted context (see _prepare_context)"""
+        prompt = prompt or get_report_generation_prompt(PRECOMPUTED_SECTIONS)
         
         messages = [
             {"role": "system", "content": prompt},
-            {"role": "user", "content": context_str}
+            {"role": "user", "content": context['prompt_input']}
         ]
         
         # Add previous error context if retrying
@@ -129,23 +431,85 @@ RETRIEVED EVIDENCE:
                 "role": "user", 
                 "content": f"Previous attempt failed with error: {context['previous_error']}. Please fix and return valid JSON."
             })
+        return messages
+    
+    def _call_llm_for_report(self, context: Dict) -> Dict:
+        """Call LLM with structured prompt for report generation"""
+        messages = self._build_messages(context)
         
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=0.2,
-            max_tokens=4000
-        )
+        with api_key_checked(self.api_key):
+            response = self.client.chat.completions.create(
+                messages=messages, **self._completion_options(_NARRATIVE_SECTIONS)
+            )
+        
+        return _parse_json_reply(response.choices[0].message.content)
+    
+    def _stream_llm_sections(self, context: Dict) -> Iterator[Tuple[str, Any]]:
+        """Stream the completion, yielding top-level report members as they close"""
+        messages = self._build_messages(context)
         
-        result_text = response.choices[0].message.content.strip()
+        with api_key_checked(self.api_key):
+            stream = self.client.chat.completions.create(
+                messages=messages, stream=True, **self._completion_options(_NARRATIVE_SECTIONS)
+            )
         
-        # Clean and parse JSON
-        if result_text.startswith('```json'):
-            result_text = result_text[7:]
-        if result_text.endswith('```'):
-            result_text = result_text[:-3]
+        parser = TopLevelJSONParser()
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield from parser.feed(delta)
         
-        return json.loads(result_text)
+        if not parser.done:
+            raise ValueError("Streamed report ended before the JSON object was complete")
+    
+    def _sectional_sections(self, context: Dict) -> Iterator[Tuple[str, Any]]:
+        """
+        Generate the section groups concurrently and merge them
+        
+        Every group gets the same retrieved context in its own AsyncOpenAI
+        call. Sections are yielded group by group as calls finish, and
+        citations are assembled last from the ids the sections cite.
+        """
+        futures = {
+            submit_async(self._generate_section_group(
+                self._build_messages(context, get_section_generation_prompt(sections, PRECOMPUTED_SECTIONS)),
+                sections
+            )): sections
+            for sections in _NARRATIVE_SECTION_GROUPS.values()
+        }
+        generated = {}
+        try:
+            for future in as_completed(futures):
+                group = future.result()
+                for name in futures[future]:
+                    if name in group:
+                        # Missing sections are left for _finalize_report to repair
+                        generated[name] = group[name]
+                        yield name, group[name]
+        finally:
+            for future in futures:
+                future.cancel()
+        
+        yield "citations", self._collect_citations(generated, context["retrieved_snippets"])
+    
+    async def _generate_section_group(self, messages: List[Dict], sections: List[str]) -> Dict:
+        """One section group's completion, parsed as JSON"""
+        with api_key_checked(self.api_key):
+            response = await self.async_client.chat.completions.create(
+                messages=messages, **self._completion_options(sections)
+            )
+        return _parse_json_reply(response.choices[0].message.content)
+    
+    @staticmethod
+    def _collect_citations(sections: Dict, snippets: List[Dict]) -> List[Dict]:
+        """Citation list for every snippet id cited anywhere in the sections"""
+        cited = _cited_ids(sections)
+        return [
+            {"id": snippet['id'], "source": snippet.get('source'), "section": snippet.get('section')}
+            for snippet in snippets if snippet['id'] in cited
+        ]
     
     def _validate_citations(self, report: ReportOut, snippets: List[Dict]) -> bool:
         """Validate that all citation_ids exist in retrieved snippets"""
@@ -25,6 +25,7 @@ from agents.pdf_parser import PDFParser
 from agents.report_orchestrator import ReportOrchestrator
 from rag.index_builder import RAGIndexBuilder
 from rag.retriever import RAGRetriever
+from rag.snapshots import current_version, resolve_snapshot
 from rules import load_rules
 from utils.formatters import render_text_report, create_clinical_snapshot
 from utils.pdf import PDFGenerator
@@ -56,6 +57,11 @@ if 'generated_report' not in st.session_state:
 if 'report_text' not in st.session_state:
     st.session_state.report_text = None
 
+@st.cache_resource
+def get_report_orchestrator() -> ReportOrchestrator:
+    """Process-wide report orchestrator shared by all sessions"""
+    return ReportOrchestrator()
+
 def ensure_rag_index():
     """Ensure RAG index exists, build if needed"""
     try:
@@ -79,9 +85,9 @@ def ensure_rag_index():
         index_path = Path("data/rag")
         index_path.mkdir(parents=True, exist_ok=True)
         
-        # Check if index already exists
-        index_file = index_path / "index.faiss"
-        if index_file.exists():
+        # Check if index already exists (published snapshot or legacy layout)
+        _, snapshot_path = resolve_snapshot(str(index_path))
+        if (snapshot_path / "index.faiss").exists():
             st.sidebar.success("✅ Using existing knowledge base")
             return True
             
@@ -90,24 +96,15 @@ def ensure_rag_index():
             try:
                 st.sidebar.info("⏳ Initializing knowledge base builder...")
                 
-                # Test API key first
-                try:
-                    import openai
-                    test_client = openai.OpenAI(api_key=api_key)
-                    test_client.models.list()
-                except Exception as e:
-                    if "Incorrect API key" in str(e):
-                        raise ValueError("The provided API key is invalid or has been revoked.")
-                    elif "Rate limit" in str(e):
-                        raise ValueError("API rate limit exceeded. Please try again later.")
-                    else:
-                        raise ValueError(f"API connection failed: {str(e)}")
-                
+                # No separate key test: the first embedding call validates it
                 builder = RAGIndexBuilder(api_key=api_key)
                 st.sidebar.info("📚 Building knowledge base index...")
                 builder.build_index()
                 
-                if index_file.exists():
+                # Drop any orchestrator created before the index existed
+                get_report_orchestrator.clear()
+                
+                if current_version(str(index_path)):
                     st.sidebar.success("✅ Knowledge base built successfully")
                     return True
                 else:
@@ -371,7 +368,7 @@ def render_report_generation():
             
             with st.spinner("🧠 Generating AI report with clinical evidence..."):
                 try:
-                    orchestrator = ReportOrchestrator()
+                    orchestrator = get_report_orchestrator()
                     
                     # Merge data sources
                     create_progress_tracker("Processing PDF")
@@ -383,7 +380,24 @@ def render_report_generation():
                     
                     # Generate report
                     create_progress_tracker("Generating Report")
-                    report, errors = orchestrator.generate_report(merged_data)
+                    
+                    # Stream sections into a preview while the model is still writing
+                    preview = st.empty()
+                    received = {}  # by section name, so a retry's re-sent sections show once
+                    summary = ""
+                    report, errors = None, []
+                    for event in orchestrator.generate_report(merged_data, stream=True):
+                        if event["type"] == "section":
+                            received[event["name"]] = event["name"].replace('_', ' ').title()
+                            if event["name"] == "executive_summary":
+                                summary = event["value"]
+                            preview.markdown(
+                                (f"**Executive summary**\n\n{summary}\n\n" if summary else "")
+                                + "  \n".join(f"✅ {title}" for title in received.values())
+                            )
+                        else:
+                            report, errors = event["report"], event["errors"]
+                    preview.empty()
                     
                     if report:
                         create_progress_tracker("Finalizing")
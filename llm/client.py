@@ -0,0 +1,150 @@
+"""
+Shared OpenAI client factory with pooled HTTP connections
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Coroutine, Dict, Optional, Tuple
+
+import httpx
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+_clients: Dict[Tuple[str, str, int], OpenAI] = {}
+_clients_lock = threading.Lock()
+
+# Async clients live on one background event loop shared by the process
+_async_clients: Dict[Tuple[str, str, int], AsyncOpenAI] = {}
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Outcome of the last real API call per key: sha256(key) -> (valid, checked_at)
+_key_status: Dict[str, Tuple[bool, float]] = {}
+_key_status_lock = threading.Lock()
+
+
+def get_openai_client(api_key: str = None, timeout: float = 60.0) -> OpenAI:
+    """
+    Return a process-wide OpenAI client for the given API key
+
+    The client keeps a pooled httpx connection so repeated calls from any
+    Streamlit session or worker thread reuse warm TCP/TLS connections.
+    OpenAI clients are thread-safe, so one instance is shared per key.
+    OPENAI_BASE_URL points every client at another OpenAI-compatible
+    endpoint, such as the local stand-in (python -m llm.local_server).
+    """
+    api_key = api_key or os.getenv('OPENAI_API_KEY')
+    base_url = os.getenv('OPENAI_BASE_URL') or None
+    max_connections = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
+    cache_key = (api_key or '', base_url or '', max_connections)
+
+    with _clients_lock:
+        client = _clients.get(cache_key)
+        if client is None:
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections
+                ),
+                timeout=timeout
+            )
+            client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+            _clients[cache_key] = client
+        return client
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _async_loop
+    with _clients_lock:
+        if _async_loop is None:
+            _async_loop = asyncio.new_event_loop()
+            threading.Thread(target=_async_loop.run_forever, name="openai-async", daemon=True).start()
+        return _async_loop
+
+
+def submit_async(coro: Coroutine) -> Future:
+    """
+    Schedule a coroutine on the shared background event loop
+
+    Works from any thread (including Streamlit script threads, which may
+    already run their own loop) and returns a concurrent Future.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop())
+
+
+def get_async_openai_client(api_key: str = None, timeout: float = 60.0) -> AsyncOpenAI:
+    """
+    Return a process-wide AsyncOpenAI client for the given API key
+
+    Only use it inside coroutines passed to submit_async: its pooled
+    connections belong to the shared background event loop.
+    """
+    api_key = api_key or os.getenv('OPENAI_API_KEY')
+    base_url = os.getenv('OPENAI_BASE_URL') or None
+    max_connections = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
+    cache_key = (api_key or '', base_url or '', max_connections)
+
+    with _clients_lock:
+        client = _async_clients.get(cache_key)
+        if client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections
+                ),
+                timeout=timeout
+            )
+            client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+            _async_clients[cache_key] = client
+        return client
+
+
+def _key_id(api_key: Optional[str]) -> str:
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()
+
+
+def check_api_key_format(api_key: Optional[str]):
+    """Offline sanity check of an OpenAI API key; raises ValueError"""
+    if not api_key:
+        raise ValueError("No OpenAI API key found. Please set the OPENAI_API_KEY environment variable.")
+    if not api_key.startswith('sk-'):
+        raise ValueError("Invalid API key format. It should start with 'sk-' or 'sk-proj-'")
+
+
+def known_key_status(api_key: Optional[str]) -> Optional[bool]:
+    """
+    Whether the key worked on its last real API call, if that is recent
+
+    Results expire after OPENAI_KEY_STATUS_TTL seconds (default 3600),
+    after which the key is unknown again until the next call.
+    """
+    ttl = float(os.getenv('OPENAI_KEY_STATUS_TTL', '3600'))
+    with _key_status_lock:
+        status = _key_status.get(_key_id(api_key))
+    if status is None or time.monotonic() - status[1] > ttl:
+        return None
+    return status[0]
+
+
+@contextmanager
+def api_key_checked(api_key: Optional[str]):
+    """
+    Wrap a real API call so it doubles as the key check
+
+    There is no separate liveness request: a key already known to be
+    bad fails fast, and otherwise the call's own outcome is recorded.
+    """
+    api_key = api_key or os.getenv('OPENAI_API_KEY')
+    if known_key_status(api_key) is False:
+        raise ValueError("The provided API key is invalid or has been revoked.")
+    try:
+        yield
+    except openai.AuthenticationError:
+        with _key_status_lock:
+            _key_status[_key_id(api_key)] = (False, time.monotonic())
+        raise ValueError("The provided API key is invalid or has been revoked.")
+    with _key_status_lock:
+        _key_status[_key_id(api_key)] = (True, time.monotonic())
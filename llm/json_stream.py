@@ -0,0 +1,78 @@
+"""
+Incremental parser for a JSON object arriving as a token stream
+"""
+import json
+from typing import Any, Iterator, Tuple
+
+
+class TopLevelJSONParser:
+    """
+    Emit each top-level (key, value) pair of a JSON object as soon as it closes
+
+    Text before the opening brace (such as a ```json fence) is skipped.
+    Only the characters added by each feed() are scanned; a member's
+    value is decoded once, when the comma or closing brace after it
+    arrives.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.started = False
+        self.done = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._phase = "key"  # key -> colon -> value, at depth 1
+        self._key_start = 0
+        self._key = None
+        self._value_start = 0
+
+    def feed(self, chunk: str) -> Iterator[Tuple[str, Any]]:
+        """Add streamed text and yield the members it completes"""
+        start = len(self.text)
+        self.text += chunk
+        for i in range(start, len(self.text)):
+            if self.done:
+                return
+            c = self.text[i]
+
+            if not self.started:
+                if c == "{":
+                    self.started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._phase == "key":
+                        self._key = json.loads(self.text[self._key_start:i + 1])
+                        self._phase = "colon"
+                continue
+
+            if c == '"':
+                self._in_string = True
+                if self._depth == 1 and self._phase == "key":
+                    self._key_start = i
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.done = True
+                    if self._phase == "value":
+                        yield self._member(i)
+            elif self._depth == 1:
+                if c == ":" and self._phase == "colon":
+                    self._phase = "value"
+                    self._value_start = i + 1
+                elif c == "," and self._phase == "value":
+                    yield self._member(i)
+                    self._phase = "key"
+
+    def _member(self, end: int) -> Tuple[str, Any]:
+        return self._key, json.loads(self.text[self._value_start:end])
@@ -0,0 +1,352 @@
+"""
+Local OpenAI-compatible stand-in for load and regression testing
+
+Serves the endpoints the app uses (chat completions, with streaming, and
+embeddings) with deterministic canned payloads, configurable latency
+and rate-limit errors. Point the app at it with
+OPENAI_BASE_URL=http://127.0.0.1:8765/v1 and any sk- key.
+
+Usage:
+    python -m llm.local_server --port 8765 --latency lognormal:400,0.5 --rpm 600
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from rag.chunker import count_tokens
+from rules.schemas.report import ReportOut
+
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+DEFAULT_EMBEDDING_DIMENSION = 1536
+# Characters per streamed content chunk (roughly one to a few tokens)
+STREAM_CHUNK_CHARS = 16
+
+_CITATION_IDS = re.compile(r'"id"\s*:\s*"([^"]+)"')
+_REQUESTED_KEYS = re.compile(r"ONLY these ReportOut keys: ([\w, ]+)\.")
+
+PDF_EXTRACTION = {
+    "labs": {
+        "hba1c_pct": 8.3, "fpg_mmol": 8.5, "ppg2h_mmol": None,
+        "egfr": 78.0, "creatinine_umol": 88.0, "acr_mgmmol": 2.1,
+        "lipids": {"tc": 5.2, "ldl": 3.2, "hdl": 1.2, "tg": 1.8}
+    },
+    "vitals": {"bp_sys": 138.0, "bp_dia": 84.0, "hr": 72.0},
+    "screenings": {"retina_date": "2025-03-14", "foot_date": "2025-06-02", "renal_date": None},
+    "warnings": []
+}
+
+CONFLICT_RESOLUTION = {
+    "recommendation": "manual_review",
+    "reasoning": "Values differ and both are plausible",
+    "confidence_threshold": 0.8
+}
+
+
+def canned_report(citation_ids: List[str]) -> Dict:
+    """A complete, valid ReportOut payload citing the given snippet ids"""
+    cite = citation_ids[:2]
+    return {
+        "executive_summary": "HbA1c is above target and LDL cholesterol is raised. "
+                             "Priorities are glycaemic control and cardiovascular risk reduction.",
+        "snapshot": {"hba1c_status": "red", "bp_status": "amber", "bmi_status": "amber",
+                     "ldl_status": "red", "risk_level": "high", "priority_actions": ["Review insulin doses"]},
+        "clinical_context": {"current_therapy": "Basal-bolus insulin", "devices": [],
+                             "complications": [], "recent_events": "No severe hypoglycaemia"},
+        "labs_table": [{"test": "HbA1c", "value": "8.3 %", "target": "≤ 7.0%",
+                        "status": "red", "comment": "Above target"}],
+        "interpretation": [{"problem": "Suboptimal glycaemic control", "assessment": "HbA1c 8.3%",
+                            "plan": "Review carbohydrate counting and basal dose", "citation_ids": cite}],
+        "lifestyle_plan": [{"text": "Aim for 150 minutes of moderate activity per week", "citation_ids": cite}],
+        "diet_plan": {"principles": ["Consistent carbohydrate counting"], "sample_meals": [],
+                      "portion_guidance": "Use the plate model", "citation_ids": cite},
+        "monitoring_plan": {"glucose_targets": "4-7 mmol/L before meals", "testing_frequency": "At least 4 times daily",
+                            "safety_checks": "Check ketones when unwell", "citation_ids": cite},
+        "screening_tracker": [{"domain": "Retinal screening", "last_date": "2025-03-14", "result": None,
+                               "next_due": "2026-03-14", "status": "up to date"}],
+        "patient_goals": ["Bring HbA1c below 7.0% within 6 months"],
+        "medication_plan": [{"text": "Consider statin therapy for raised LDL", "citation_ids": cite}],
+        "follow_up": [{"when": "3 months", "actions": ["Repeat HbA1c", "Review lipids"]}],
+        "emr_note": "T1DM review. HbA1c 8.3%, LDL 3.2. Insulin and lipid management reviewed.",
+        "citations": [{"id": snippet_id, "source": "local", "section": "stub"} for snippet_id in cite],
+    }
+
+
+def fake_embedding(text: str, dimension: int) -> np.ndarray:
+    """Unit vector seeded from the text, so equal inputs embed identically"""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype('float32')
+    return vector / np.linalg.norm(vector)
+
+
+class LatencyModel:
+    """
+    Response delay sampled from a distribution spec
+
+    fixed:MS | uniform:LO_MS,HI_MS | normal:MEAN_MS,SD_MS |
+    lognormal:MEDIAN_MS,SIGMA
+    """
+
+    def __init__(self, spec: str = "fixed:0", seed: int = 0):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        """Delay in seconds"""
+        with self._lock:
+            if self.kind == "fixed":
+                ms = self.params[0] if self.params else 0.0
+            elif self.kind == "uniform":
+                ms = self._rng.uniform(*self.params[:2])
+            elif self.kind == "normal":
+                ms = self._rng.gauss(*self.params[:2])
+            else:
+                ms = self.params[0] * self._rng.lognormvariate(0.0, self.params[1])
+        return max(0.0, ms) / 1000
+
+
+class RateLimiter:
+    """Requests-per-minute window plus a random 429 probability"""
+
+    def __init__(self, rpm: int = 0, error_rate: float = 0.0, seed: int = 0):
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self._requests = deque()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def check(self) -> Optional[float]:
+        """None if the request may proceed, otherwise seconds to wait"""
+        now = time.monotonic()
+        with self._lock:
+            if self.error_rate and self._rng.random() < self.error_rate:
+                return 1.0
+            if self.rpm:
+                while self._requests and now - self._requests[0] >= 60:
+                    self._requests.popleft()
+                if len(self._requests) >= self.rpm:
+                    return 60 - (now - self._requests[0])
+                self._requests.append(now)
+        return None
+
+
+class LocalOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: LatencyModel = None, limiter: RateLimiter = None,
+                 chunk_delay: float = 0.0):
+        super().__init__(address, _Handler)
+        self.latency = latency or LatencyModel()
+        self.limiter = limiter or RateLimiter()
+        self.chunk_delay = chunk_delay
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_local_server(host: str = "127.0.0.1", port: int = 0, latency: str = "fixed:0",
+                       rpm: int = 0, error_rate: float = 0.0, chunk_delay_ms: float = 0.0,
+                       seed: int = 0) -> LocalOpenAIServer:
+    """Run a server in a daemon thread (port 0 picks a free port); see .base_url"""
+    server = LocalOpenAIServer(
+        (host, port), LatencyModel(latency, seed), RateLimiter(rpm, error_rate, seed), chunk_delay_ms / 1000
+    )
+    threading.Thread(target=server.serve_forever, name="local-openai", daemon=True).start()
+    return server
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: LocalOpenAIServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            models = ["gpt-4o-mini", *EMBEDDING_DIMENSIONS]
+            self._send_json(200, {"object": "list",
+                                  "data": [{"id": m, "object": "model", "owned_by": "local"} for m in models]})
+        else:
+            self._send_error(404, f"Unknown path {self.path}", "invalid_request_error")
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self._send_error(401, "Missing API key", "invalid_request_error", "invalid_api_key")
+            return
+
+        retry_after = self.server.limiter.check()
+        if retry_after is not None:
+            self._send_error(429, "Rate limit reached", "requests", "rate_limit_exceeded",
+                             {"Retry-After": f"{max(retry_after, 0.0):.0f}"})
+            return
+
+        time.sleep(self.server.latency.sample())
+        path = self.path.rstrip("/")
+        if path.endswith("/chat/completions"):
+            self._chat_completion(body)
+        elif path.endswith("/embeddings"):
+            self._embeddings(body)
+        else:
+            self._send_error(404, f"Unknown path {self.path}", "invalid_request_error")
+
+    def _chat_completion(self, body: Dict):
+        messages = body.get("messages", [])
+        content = json.dumps(self._reply_payload(messages, body), ensure_ascii=False)
+        prompt_tokens = sum(count_tokens(str(m.get("content", ""))) for m in messages)
+        completion_tokens = count_tokens(content)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = body.get("model", "gpt-4o-mini")
+
+        if body.get("stream"):
+            self._stream_completion(completion_id, model, content)
+            return
+
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                         "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    @staticmethod
+    def _reply_payload(messages: List[Dict], body: Dict) -> Dict:
+        """Canned JSON chosen from the system prompt and requested sections"""
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        user = "\n".join(str(m.get("content", "")) for m in messages if m.get("role") == "user")
+
+        if "lab-extraction" in system:
+            return PDF_EXTRACTION
+        if "form_value" in system:
+            return CONFLICT_RESOLUTION
+
+        evidence = user.split("RETRIEVED EVIDENCE", 1)[-1] if "RETRIEVED EVIDENCE" in user else ""
+        report = canned_report(list(dict.fromkeys(_CITATION_IDS.findall(evidence))))
+        schema = body.get("response_format", {}).get("json_schema", {}).get("schema", {})
+        if schema.get("properties"):
+            sections = list(schema["properties"])
+        elif _REQUESTED_KEYS.search(system):
+            sections = [name.strip() for name in _REQUESTED_KEYS.search(system).group(1).split(",")]
+        else:
+            sections = list(ReportOut.model_fields)
+        return {name: report[name] for name in sections if name in report}
+
+    def _stream_completion(self, completion_id: str, model: str, content: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(delta: Dict, finish_reason: str = None):
+            self._write_chunk("data: " + json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }) + "\n\n")
+
+        event({"role": "assistant", "content": ""})
+        for start in range(0, len(content), STREAM_CHUNK_CHARS):
+            if self.server.chunk_delay:
+                time.sleep(self.server.chunk_delay)
+            event({"content": content[start:start + STREAM_CHUNK_CHARS]})
+        event({}, "stop")
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _embeddings(self, body: Dict):
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        model = body.get("model", "text-embedding-3-small")
+        dimension = body.get("dimensions") or EMBEDDING_DIMENSIONS.get(model, DEFAULT_EMBEDDING_DIMENSION)
+
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(str(text), dimension)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype('<f4').tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+        tokens = sum(count_tokens(str(text)) for text in inputs)
+        self._send_json(200, {"object": "list", "data": data, "model": model,
+                              "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    def _send_json(self, status: int, payload: Dict, headers: Dict = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, message: str, error_type: str, code: str = None,
+                    headers: Dict = None):
+        self._send_json(status, {"error": {"message": message, "type": error_type,
+                                           "param": None, "code": code}}, headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="fixed:0",
+                        help="fixed:MS, uniform:LO,HI, normal:MEAN,SD or lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--chunk-delay-ms", type=float, default=0.0,
+                        help="Delay between streamed chunks")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before 429s (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of a random 429")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server = LocalOpenAIServer(
+        (args.host, args.port), LatencyModel(args.latency, args.seed),
+        RateLimiter(args.rpm, args.error_rate, args.seed), args.chunk_delay_ms / 1000
+    )
+    print(f"Serving OpenAI stand-in on {server.base_url} (set OPENAI_BASE_URL to this)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Token-budgeted, compact LLM input for report generation
+"""
+import json
+import os
+from typing import Callable, Dict, List, NamedTuple
+
+from rag.chunker import count_tokens
+
+# Rule keys and the intake fields that make them relevant; rule keys not
+# listed here are always sent
+_RULE_FIELDS = {
+    "hba1c_t1dm_target_pct": ("labs.hba1c_pct",),
+    "bp_target_sys": ("bp_sys",),
+    "bp_target_dia": ("bp_dia",),
+    "bmi_overweight": ("weight_kg",),
+    "ldl_high_risk_target": ("labs.lipids.ldl",),
+    "acr_albuminuria": ("labs.acr", "labs.acr_mgmmol"),
+    "egfr_ok": ("labs.eGFR", "labs.egfr"),
+    "traffic.hbA1c": ("labs.hba1c_pct",),
+    "traffic.bp_sys": ("bp_sys",),
+    "traffic.bmi": ("weight_kg",),
+    "traffic.ldl": ("labs.lipids.ldl",),
+    "units.glucose_conversion": ("labs.fpg_mmol", "labs.ppg2h_mmol"),
+    "units.hba1c_conversion": ("labs.hba1c_pct",),
+}
+_SNIPPET_FIELDS = ("id", "source", "section", "text")
+
+
+def compact_json(value) -> str:
+    """JSON without indentation or spaces after separators"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def _present(data: Dict, path: str) -> bool:
+    for key in path.split("."):
+        if not isinstance(data, dict) or data.get(key) in (None, "", [], {}):
+            return False
+        data = data[key]
+    return True
+
+
+def _drop_empty(value):
+    """Copy without None, empty strings and empty containers"""
+    if isinstance(value, dict):
+        items = ((key, _drop_empty(item)) for key, item in value.items())
+        return {key: item for key, item in items if item not in (None, "", [], {})}
+    if isinstance(value, list):
+        return [_drop_empty(item) for item in value]
+    return value
+
+
+def _rule_applies(patient: Dict, rule_path: str) -> bool:
+    fields = _RULE_FIELDS.get(rule_path)
+    return fields is None or any(_present(patient, field) for field in fields)
+
+
+def relevant_rules(patient: Dict, rules: Dict) -> Dict:
+    """Rules restricted to the thresholds that apply to fields in the intake"""
+    selected = {}
+    for key, value in rules.items():
+        if isinstance(value, dict):
+            kept = {sub: item for sub, item in value.items() if _rule_applies(patient, f"{key}.{sub}")}
+            if kept:
+                selected[key] = kept
+        elif _rule_applies(patient, key):
+            selected[key] = value
+    return selected
+
+
+class PromptInput(NamedTuple):
+    text: str
+    snippets: List[Dict]          # snippets included, in prompt order
+    token_counts: Dict[str, int]  # per section, plus "total"
+    warnings: List[str]           # evidence trimmed or over budget
+
+
+class PromptBuilder:
+    """
+    Serialize the report context compactly within a token budget
+
+    Patient data, relevant rules and precomputed sections are always
+    included; retrieved snippets are packed by relevance score into the
+    tokens left over, keeping at least the top-scoring one even when it
+    overruns. Trimmed evidence is reported in PromptInput.warnings.
+
+    The budget (PROMPT_TOKEN_BUDGET, default 6000) covers this user
+    message only; the system prompt and the section instructions are
+    not counted against it.
+    """
+
+    def __init__(self, token_budget: int = None, counter: Callable[[str], int] = count_tokens):
+        self.token_budget = token_budget or int(os.getenv('PROMPT_TOKEN_BUDGET', '6000'))
+        self.count_tokens = counter
+
+    def build(self, context: Dict) -> PromptInput:
+        patient = _drop_empty(context['patient_intake'])
+        blocks = [
+            ("patient_intake", "PATIENT DATA", compact_json(patient)),
+            ("rules", "CLINICAL RULES", compact_json(relevant_rules(patient, context['rules']))),
+        ]
+        if context.get('precomputed_sections'):
+            blocks.append(("precomputed_sections", "PRECOMPUTED SECTIONS",
+                           compact_json(context['precomputed_sections'])))
+
+        token_counts = {}
+        for name, label, body in blocks:
+            token_counts[name] = self.count_tokens(f"{label}:\n{body}\n")
+
+        remaining = self.token_budget - sum(token_counts.values()) - self.count_tokens("RETRIEVED EVIDENCE:\n[]")
+        retrieved = context['retrieved_snippets']
+        snippets, snippet_text = self._pack_snippets(retrieved, remaining)
+        blocks.append(("retrieved_snippets", "RETRIEVED EVIDENCE", snippet_text))
+        token_counts["retrieved_snippets"] = self.count_tokens(f"RETRIEVED EVIDENCE:\n{snippet_text}\n")
+
+        text = "\n".join(f"{label}:\n{body}\n" for _, label, body in blocks)
+        token_counts["total"] = sum(token_counts.values())
+
+        warnings = []
+        if len(snippets) < len(retrieved):
+            warnings.append(f"Prompt token budget ({self.token_budget}) left room for "
+                            f"{len(snippets)} of {len(retrieved)} retrieved snippets")
+        if token_counts["total"] > self.token_budget:
+            warnings.append(f"Report prompt is {token_counts['total']} tokens, over the "
+                            f"{self.token_budget} token budget")
+        return PromptInput(text, snippets, token_counts, warnings)
+
+    def _pack_snippets(self, snippets: List[Dict], budget: int):
+        """Highest-scoring snippets that fit the budget (at least one), as a compact JSON array"""
+        ranked = sorted(snippets, key=lambda snippet: -snippet.get('relevance_score', 0.0))
+        packed, parts, used = [], [], 0
+        for snippet in ranked:
+            projected = {field: snippet[field] for field in _SNIPPET_FIELDS if field in snippet}
+            part = compact_json(projected)
+            tokens = self.count_tokens(part) + 1  # separator
+            if packed and used + tokens > budget:
+                continue
+            packed.append(snippet)
+            parts.append(part)
+            used += tokens
+        return packed, f"[{','.join(parts)}]"
@@ -19,38 +19,91 @@ OUTPUT: a valid JSON dict with keys:
 Rules: convert all glucose to mmol/L, round to 1 dp; HbA1c to % if reported in mmol/mol (convert 48 mmol/mol → 6.5%).
 Return JSON only."""
 
-def get_report_generation_prompt() -> str:
-    """Prompt for single-pass report generation"""
-    return """Role: NHS Diabetes Consultant Assistant (UK). Audience: clinician + patient summary.
+# Output format for each ReportOut section, in report order
+REPORT_SECTION_FORMATS = {
+    "executive_summary": "2-3 sentences summarizing key clinical status and priorities",
+    "snapshot": "{hba1c_status, bp_status, bmi_status, ldl_status, risk_level, priority_actions}",
+    "clinical_context": "{current_therapy, devices, complications, recent_events}",
+    "labs_table": "[{test, value, target, status, comment}] - include all available labs",
+    "interpretation": "[{problem, assessment, plan, citation_ids}] - clinical reasoning",
+    "lifestyle_plan": "[{text, citation_ids}] - specific lifestyle recommendations",
+    "diet_plan": "{principles, sample_meals, portion_guidance, citation_ids}",
+    "monitoring_plan": "{glucose_targets, testing_frequency, safety_checks, citation_ids}",
+    "screening_tracker": "[{domain, last_date, result, next_due, status}] - annual checks",
+    "patient_goals": "[list of specific, measurable goals]",
+    "medication_plan": "[{text, citation_ids}] - medication recommendations",
+    "follow_up": "[{when, actions}] - follow-up schedule",
+    "emr_note": "concise clinical note for medical records",
+    "citations": "[{id, source, section}] - all referenced sources",
+}
+
+# Sections generated together in sectional mode; groups are independent
+# given the shared context, and citations are assembled from the results
+REPORT_SECTION_GROUPS = {
+    "overview": ["executive_summary", "clinical_context", "interpretation", "patient_goals", "emr_note"],
+    "labs": ["labs_table", "snapshot"],
+    "lifestyle": ["lifestyle_plan", "diet_plan"],
+    "monitoring": ["monitoring_plan", "screening_tracker"],
+    "medication": ["medication_plan", "follow_up"],
+}
+
+_REPORT_PROMPT_HEADER = """Role: NHS Diabetes Consultant Assistant (UK). Audience: clinician + patient summary.
 
 You receive:
 1) patient_intake (JSON),
 2) rules (JSON thresholds),
 3) retrieved_snippets (array of {id, source, section, text})
+"""
+
+_PRECOMPUTED_INPUT = "4) precomputed_sections (JSON; computed locally from rules and patient_intake)\n"
+
+_REPORT_PROMPT_RULES = ("Every recommendation must include >=1 citation_ids that map to retrieved_snippets[]. "
+                        "Do NOT invent facts. Use rules for targets and traffic-light. "
+                        "Round all values sensibly (HbA1c 1 dp; mmol/L 1 dp; BP ints).")
 
-TASK: produce ONE valid JSON of type ReportOut. Every recommendation must include >=1 citation_ids that map to retrieved_snippets[]. Do NOT invent facts. Use rules for targets and traffic-light. Round all values sensibly (HbA1c 1 dp; mmol/L 1 dp; BP ints).
 
-Required sections (non-empty): executive_summary, snapshot, clinical_context, labs_table, interpretation, lifestyle_plan, diet_plan, monitoring_plan, screening_tracker, patient_goals, medication_plan, follow_up, emr_note, citations.
+def _report_prompt(task: str, sections: list, precomputed: tuple = ()) -> str:
+    formats = "\n".join(f"- {name}: {REPORT_SECTION_FORMATS[name]}" for name in sections)
+    header = _REPORT_PROMPT_HEADER
+    if precomputed:
+        header += _PRECOMPUTED_INPUT
+        task += (f" {', '.join(precomputed)} are already in precomputed_sections: do not return them,"
+                 " but keep the narrative consistent with them.")
+    return f"""{header}
+TASK: {task} {_REPORT_PROMPT_RULES}
+
+Required sections (non-empty): {', '.join(sections)}.
 
 Format guidelines:
-- executive_summary: 2-3 sentences summarizing key clinical status and priorities
-- snapshot: {hba1c_status, bp_status, bmi_status, risk_level, priority_actions}
-- clinical_context: {current_therapy, devices, complications, recent_events}
-- labs_table: [{test, value, target, status, comment}] - include all available labs
-- interpretation: [{problem, assessment, plan, citation_ids}] - clinical reasoning
-- lifestyle_plan: [{text, citation_ids}] - specific lifestyle recommendations
-- diet_plan: {principles, sample_meals, portion_guidance, citation_ids}
-- monitoring_plan: {glucose_targets, testing_frequency, safety_checks, citation_ids}
-- screening_tracker: [{domain, last_date, result, next_due, status}] - annual checks
-- patient_goals: [list of specific, measurable goals]
-- medication_plan: [{text, citation_ids}] - medication recommendations
-- follow_up: [{when, actions}] - follow-up schedule
-- emr_note: concise clinical note for medical records
-- citations: [{id, source, section}] - all referenced sources
+{formats}
 
 Drop any recommendation you cannot cite.
 Return JSON only."""
 
+
+def get_report_generation_prompt(precomputed: tuple = ()) -> str:
+    """
+    Prompt for single-pass report generation
+
+    Sections named in precomputed are filled in locally (see
+    rules.sections), so the model is asked only for the rest.
+    """
+    if not precomputed:
+        return _report_prompt("produce ONE valid JSON of type ReportOut.", list(REPORT_SECTION_FORMATS))
+    sections = [name for name in REPORT_SECTION_FORMATS if name not in precomputed]
+    return _report_prompt(
+        f"produce ONE valid JSON object with ONLY these ReportOut keys: {', '.join(sections)}.",
+        sections, precomputed
+    )
+
+
+def get_section_generation_prompt(sections: list, precomputed: tuple = ()) -> str:
+    """Prompt for one group of sections in sectional report generation"""
+    return _report_prompt(
+        f"produce ONE valid JSON object with ONLY these ReportOut keys: {', '.join(sections)}.",
+        sections, precomputed
+    )
+
 def get_conflict_resolution_prompt() -> str:
     """Prompt for handling PDF vs form conflicts"""
     return """You are helping resolve conflicts between form-entered data and PDF-extracted data.
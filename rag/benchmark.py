@@ -0,0 +1,126 @@
+"""
+Recall and latency benchmark for the FAISS index types
+
+Usage:
+    python -m rag.benchmark --vectors 100000 --dim 384
+    python -m rag.benchmark --index-path data/rag
+"""
+import argparse
+import time
+from typing import Dict, List
+
+import faiss
+import numpy as np
+
+from rag.index_factory import INDEX_TYPES, build_faiss_index, choose_index_params
+
+
+def synthetic_vectors(n_vectors: int, dimension: int, n_clusters: int = 200,
+                      seed: int = 42) -> np.ndarray:
+    """Clustered unit vectors, closer to real embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_clusters, dimension)).astype('float32')
+    labels = rng.integers(0, n_clusters, size=n_vectors)
+    vectors = centres[labels] + 0.5 * rng.standard_normal((n_vectors, dimension)).astype('float32')
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def load_index_vectors(index_path: str) -> np.ndarray:
+    """Reconstruct the stored vectors of an existing index"""
+    index = faiss.read_index(f"{index_path}/index.faiss")
+    if hasattr(index, "make_direct_map"):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def make_queries(vectors: np.ndarray, n_queries: int, seed: int = 7) -> np.ndarray:
+    """Perturbed copies of corpus vectors used as queries"""
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[picks] + 0.1 * rng.standard_normal((len(picks), vectors.shape[1])).astype('float32')
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    faiss.normalize_L2(queries)
+    return queries
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    """Fraction of the exact top-k neighbours that the index returned"""
+    k = truth.shape[1]
+    hits = sum(len(set(f[:k]) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def time_queries(index: faiss.Index, queries: np.ndarray, k: int) -> np.ndarray:
+    """Per-query latencies in milliseconds (single-query search, as in retrieval)"""
+    latencies = []
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        index.search(queries[i:i + 1], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+
+def run_benchmark(vectors: np.ndarray, n_queries: int = 500, k: int = 10,
+                  index_types: List[str] = None, memory_budget_mb: float = None) -> List[Dict]:
+    """Build each index type and compare it with the exact flat baseline"""
+    index_types = index_types or list(INDEX_TYPES)
+    queries = make_queries(vectors, n_queries)
+
+    flat = build_faiss_index(vectors, choose_index_params(len(vectors), vectors.shape[1],
+                                                          index_type="flat"))
+    _, truth = flat.search(queries, k)
+
+    auto_type = choose_index_params(len(vectors), vectors.shape[1], memory_budget_mb)["type"]
+    rows = []
+    for index_type in index_types:
+        params = choose_index_params(len(vectors), vectors.shape[1], memory_budget_mb,
+                                     index_type=index_type)
+        start = time.perf_counter()
+        index = flat if index_type == "flat" else build_faiss_index(vectors, params)
+        build_s = time.perf_counter() - start
+
+        _, found = index.search(queries, k)
+        latencies = time_queries(index, queries, k)
+        rows.append({
+            "type": index_type,
+            "auto": index_type == auto_type,
+            "recall": recall_at_k(found, truth),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "build_s": build_s,
+            "memory_mb": params["estimated_memory_mb"],
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index types for RAG")
+    parser.add_argument("--index-path", help="Benchmark vectors from an existing index")
+    parser.add_argument("--vectors", type=int, default=50_000, help="Synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=384, help="Synthetic vector dimension")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--memory-mb", type=float, default=None)
+    parser.add_argument("--types", nargs="*", choices=INDEX_TYPES)
+    args = parser.parse_args()
+
+    if args.index_path:
+        vectors = load_index_vectors(args.index_path)
+    else:
+        vectors = synthetic_vectors(args.vectors, args.dim)
+
+    print(f"Benchmarking {len(vectors)} vectors (dim {vectors.shape[1]}), "
+          f"{args.queries} queries, k={args.k}")
+    rows = run_benchmark(vectors, args.queries, args.k, args.types, args.memory_mb)
+
+    print(f"{'type':<10}{'recall@k':>10}{'p50 ms':>10}{'p99 ms':>10}{'build s':>10}{'mem MB':>10}")
+    for row in rows:
+        marker = " *" if row["auto"] else ""
+        print(f"{row['type']:<10}{row['recall']:>10.3f}{row['p50_ms']:>10.3f}"
+              f"{row['p99_ms']:>10.3f}{row['build_s']:>10.2f}{row['memory_mb']:>10.1f}{marker}")
+    print("* = type chosen automatically for this corpus size and memory budget")
+
+
+if __name__ == "__main__":
+    main()
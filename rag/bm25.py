@@ -0,0 +1,111 @@
+"""
+Precomputed inverted BM25 index over guideline chunks
+"""
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word/number tokens; keeps decimals such as '2.0' whole"""
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 with per-posting weights computed once at build time
+
+    Each posting stores the full BM25 term weight for (term, document),
+    so a query only gathers postings for its terms and sums them.
+    """
+
+    def __init__(self, texts: List[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.num_docs = len(texts)
+
+        doc_tokens = [tokenize(text) for text in texts]
+        doc_lengths = np.array([len(tokens) for tokens in doc_tokens], dtype='float32')
+        avg_length = float(doc_lengths.mean()) if self.num_docs else 0.0
+        length_norm = k1 * (1 - b + b * doc_lengths / (avg_length or 1.0))
+
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc_id, tokens in enumerate(doc_tokens):
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for term, entries in postings.items():
+            doc_ids = np.array([doc_id for doc_id, _ in entries], dtype='int64')
+            tfs = np.array([tf for _, tf in entries], dtype='float32')
+            df = len(entries)
+            # Non-negative idf variant so common terms never subtract
+            idf = np.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            weights = idf * tfs * (k1 + 1) / (tfs + length_norm[doc_ids])
+            self.postings[term] = (doc_ids, weights.astype('float32'))
+
+    def save(self, path: str):
+        """Persist postings as CSR arrays (terms, offsets, doc ids, weights)"""
+        terms = sorted(self.postings)
+        lengths = [len(self.postings[term][0]) for term in terms]
+        offsets = np.zeros(len(terms) + 1, dtype='int64')
+        np.cumsum(lengths, out=offsets[1:])
+        np.savez(
+            path,
+            terms=np.array(terms, dtype=str),
+            offsets=offsets,
+            doc_ids=np.concatenate([self.postings[t][0] for t in terms]) if terms else np.zeros(0, 'int64'),
+            weights=np.concatenate([self.postings[t][1] for t in terms]) if terms else np.zeros(0, 'float32'),
+            params=np.array([self.k1, self.b, self.num_docs], dtype='float64')
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Load postings saved with save(), without re-tokenizing any text"""
+        index = cls.__new__(cls)
+        with np.load(path) as data:
+            k1, b, num_docs = data['params']
+            index.k1, index.b, index.num_docs = float(k1), float(b), int(num_docs)
+            offsets, doc_ids, weights = data['offsets'], data['doc_ids'], data['weights']
+            index.postings = {
+                str(term): (doc_ids[offsets[i]:offsets[i + 1]], weights[offsets[i]:offsets[i + 1]])
+                for i, term in enumerate(data['terms'])
+            }
+        return index
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every document for the query"""
+        scores = np.zeros(self.num_docs, dtype='float32')
+        for term in tokenize(query):
+            posting = self.postings.get(term)
+            if posting is not None:
+                doc_ids, weights = posting
+                scores[doc_ids] += weights
+        return scores
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (doc_id, score) pairs with a positive score"""
+        scores = self.scores(query)
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        order = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in order]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """
+    Fuse several ranked doc-id lists with reciprocal rank fusion
+
+    score(d) = sum over lists of 1 / (k + rank(d)), rank starting at 1.
+    Ties keep the order in which documents were first seen.
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
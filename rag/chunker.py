@@ -0,0 +1,126 @@
+"""
+Token-aware chunking over character offsets
+
+Chunks are sized in tokens rather than words, break only at sentence
+boundaries (or between words for an over-long sentence) and never run
+across a markdown heading. Only '#' lines count as headings: short
+unpunctuated lines such as list items or a final sentence without a
+full stop are body text, and ingested documents are already split at
+their parsed headings before chunking. The chunker yields (start, end, tokens) spans into the
+original text, so nothing is copied until a caller slices out a chunk.
+"""
+import os
+import re
+from typing import Callable, Iterator, List, NamedTuple, Tuple
+
+# Sentence ends followed by whitespace (so "6.5%" stays whole), blank
+# lines, and line breaks before a markdown heading
+_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n\s*\n|\n(?=[ \t]*#)")
+_WORD = re.compile(r"\S+")
+# Approximates BPE pieces: up to 4 word characters, or one punctuation mark
+_TOKEN_PIECE = re.compile(r"\w{1,4}|[^\w\s]")
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional; fall back to the approximation
+    _ENCODING = None
+
+
+def count_tokens(text: str) -> int:
+    """Token count with the cl100k tokenizer, or a close approximation without it"""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return len(_TOKEN_PIECE.findall(text))
+
+
+class ChunkSpan(NamedTuple):
+    start: int
+    end: int
+    tokens: int
+
+
+class TokenChunker:
+    """Split text into token-bounded, sentence-aligned chunks with token overlap"""
+
+    def __init__(self, target_tokens: int = None, overlap_tokens: int = None,
+                 counter: Callable[[str], int] = count_tokens):
+        self.target_tokens = target_tokens or int(os.getenv('CHUNK_TARGET_TOKENS', '300'))
+        self.overlap_tokens = (int(os.getenv('CHUNK_OVERLAP_TOKENS', '50'))
+                               if overlap_tokens is None else overlap_tokens)
+        if not 0 <= self.overlap_tokens < self.target_tokens:
+            raise ValueError("Chunk overlap must be non-negative and smaller than the target size")
+        self.count_tokens = counter
+
+    def _units(self, text: str) -> Iterator[Tuple[int, int, bool]]:
+        """(start, end, is_heading) for each sentence or heading"""
+        position = 0
+        for match in _BOUNDARY.finditer(text):
+            yield from self._unit(text, position, match.start())
+            position = match.end()
+        yield from self._unit(text, position, len(text))
+
+    def _unit(self, text: str, start: int, end: int) -> Iterator[Tuple[int, int, bool]]:
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start == end:
+            return
+        first_line_end = text.find("\n", start, end)
+        if text[start] == "#":
+            # A heading line starts a unit of its own; the rest is body text
+            heading_end = end if first_line_end == -1 else first_line_end
+            yield start, heading_end, True
+            if heading_end < end:
+                yield from self._unit(text, heading_end, end)
+            return
+        yield start, end, False
+
+    def _pieces(self, text: str) -> Iterator[Tuple[int, int, int, bool]]:
+        """Units with token counts; sentences over the target split between words"""
+        for start, end, is_heading in self._units(text):
+            tokens = self.count_tokens(text[start:end])
+            if tokens <= self.target_tokens:
+                yield start, end, tokens, is_heading
+                continue
+            for word in _WORD.finditer(text, start, end):
+                yield word.start(), word.end(), self.count_tokens(word.group()), False
+
+    def spans(self, text: str) -> Iterator[ChunkSpan]:
+        """Yield chunk spans in order; consecutive chunks share up to overlap_tokens"""
+        current: List[Tuple[int, int, int]] = []
+        total = 0
+        fresh = False  # current holds pieces not yet emitted
+
+        for start, end, tokens, is_heading in self._pieces(text):
+            if current and (is_heading or total + tokens > self.target_tokens):
+                if fresh:
+                    yield self._span(text, current)
+                if is_heading:
+                    current, total = [], 0
+                else:
+                    current, total = self._overlap_tail(current)
+                    while current and total + tokens > self.target_tokens:
+                        total -= current.pop(0)[2]
+                fresh = False
+            current.append((start, end, tokens))
+            total += tokens
+            fresh = True
+
+        if current and fresh:
+            yield self._span(text, current)
+
+    def _overlap_tail(self, pieces: List[Tuple[int, int, int]]) -> Tuple[List, int]:
+        """Trailing pieces of a chunk fitting in the overlap budget"""
+        tail, total = [], 0
+        for piece in reversed(pieces):
+            if total + piece[2] > self.overlap_tokens:
+                break
+            tail.insert(0, piece)
+            total += piece[2]
+        return tail, total
+
+    def _span(self, text: str, pieces: List[Tuple[int, int, int]]) -> ChunkSpan:
+        start, end = pieces[0][0], pieces[-1][1]
+        return ChunkSpan(start, end, self.count_tokens(text[start:end]))
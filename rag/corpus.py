@@ -0,0 +1,288 @@
+"""
+Compiled guideline corpus shared read-only by every retriever in the process
+
+The corpus source (data/guidelines/corpus.json) is compiled into a
+versioned artifact directory holding document metadata with token
+counts, chunk text, source metadata, BM25 postings and optionally dense
+vectors. A CURRENT file names the published version. get_corpus() keeps one open copy per
+process and picks up a newly published version on the next call.
+
+Usage:
+    python -m rag.corpus [--embedder hashing|local|openai]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from rag.bm25 import BM25Index
+from rag.chunker import count_tokens
+from rag.text_store import TextStore, write_text_store
+
+CORPUS_SOURCE = "data/guidelines/corpus.json"
+CORPUS_DIR = "data/corpus"
+FORMAT_VERSION = 2
+
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+DOCUMENTS_FILE = "documents.json"
+SOURCES_FILE = "sources.json"
+BM25_FILE = "bm25.npz"
+VECTORS_FILE = "vectors.npy"
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _integrity_hash(artifact_dir: Path, files: List[str]) -> str:
+    """Combined sha256 over the artifact files, in name order"""
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(name.encode('utf-8'))
+        digest.update(_file_sha256(artifact_dir / name).encode('ascii'))
+    return digest.hexdigest()
+
+
+def compile_corpus(source_path: str = CORPUS_SOURCE, corpus_dir: str = CORPUS_DIR,
+                   embedder=None) -> Path:
+    """
+    Compile the corpus source into a new versioned artifact and publish it
+
+    The version is derived from the source content (and embedder), so
+    recompiling unchanged input republishes the same version.
+    """
+    with open(source_path, 'r', encoding='utf-8') as f:
+        source = json.load(f)
+
+    canonical = json.dumps(source, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    source_hash = hashlib.sha256(canonical).hexdigest()
+    embedder_name = embedder.name if embedder is not None else None
+    version_key = f"{FORMAT_VERSION}:{source_hash}:{embedder_name}"
+    version = f"v{FORMAT_VERSION}-{hashlib.sha256(version_key.encode('utf-8')).hexdigest()[:12]}"
+
+    root = Path(corpus_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    final_dir = root / version
+
+    if not final_dir.exists():
+        documents = source.get("documents", [])
+        tmp_dir = root / f".tmp-{uuid.uuid4().hex}"
+        tmp_dir.mkdir()
+        try:
+            texts = [doc["text"] for doc in documents]
+            with open(tmp_dir / DOCUMENTS_FILE, 'w', encoding='utf-8') as f:
+                json.dump([
+                    {**{k: v for k, v in doc.items() if k != "text"}, "tokens": count_tokens(doc["text"])}
+                    for doc in documents
+                ], f, ensure_ascii=False)
+            with open(tmp_dir / SOURCES_FILE, 'w', encoding='utf-8') as f:
+                json.dump(source.get("sources", {}), f, ensure_ascii=False)
+            write_text_store(texts, str(tmp_dir))
+            BM25Index(texts).save(str(tmp_dir / BM25_FILE))
+
+            files = [DOCUMENTS_FILE, SOURCES_FILE, BM25_FILE, "chunks.bin", "chunks.offsets.npy"]
+            if embedder is not None:
+                np.save(tmp_dir / VECTORS_FILE, np.asarray(embedder.embed(texts), dtype='float32'))
+                files.append(VECTORS_FILE)
+
+            manifest = {
+                "name": source.get("name", "guidelines"),
+                "version": version,
+                "format_version": FORMAT_VERSION,
+                "source_sha256": source_hash,
+                "num_documents": len(documents),
+                "embedder": embedder_name,
+                "files": sorted(files),
+                "integrity_sha256": _integrity_hash(tmp_dir, files),
+                "created_at": datetime.now().isoformat(timespec='seconds'),
+            }
+            with open(tmp_dir / MANIFEST_FILE, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2)
+
+            try:
+                os.replace(tmp_dir, final_dir)
+            except OSError:
+                # Another process published the same version first
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    # Flip CURRENT atomically so readers see either the old or new version
+    tmp_current = root / f"{CURRENT_FILE}.{uuid.uuid4().hex}.tmp"
+    tmp_current.write_text(version, encoding='utf-8')
+    os.replace(tmp_current, root / CURRENT_FILE)
+
+    print(f"📦 Published guideline corpus {version} ({final_dir})")
+    return final_dir
+
+
+class GuidelineCorpus:
+    """Read-only view of one compiled corpus version"""
+
+    def __init__(self, artifact_dir: Path):
+        self.path = Path(artifact_dir)
+        with open(self.path / MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+
+        integrity = _integrity_hash(self.path, self.manifest["files"])
+        if integrity != self.manifest["integrity_sha256"]:
+            raise ValueError(f"Corpus artifact {self.path} failed its integrity check")
+
+        self.version = self.manifest["version"]
+        self.embedder_name: Optional[str] = self.manifest.get("embedder")
+
+        text_store = TextStore(str(self.path))
+        with open(self.path / DOCUMENTS_FILE, 'r', encoding='utf-8') as f:
+            self.documents: List[Dict] = json.load(f)
+        for row, doc in enumerate(self.documents):
+            doc["text"] = text_store.get(row)
+
+        with open(self.path / SOURCES_FILE, 'r', encoding='utf-8') as f:
+            self.sources: Dict[str, Dict] = json.load(f)
+
+        self.bm25 = BM25Index.load(str(self.path / BM25_FILE))
+        vectors_file = self.path / VECTORS_FILE
+        self.vectors = np.load(vectors_file, mmap_mode='r') if vectors_file.exists() else None
+
+        self._derived: Dict[str, Any] = {}
+        self._derived_lock = threading.Lock()
+
+    def derived(self, key: str, factory: Callable[[], Any]) -> Any:
+        """Build a structure from the corpus once per version and share it"""
+        with self._derived_lock:
+            if key not in self._derived:
+                self._derived[key] = factory()
+            return self._derived[key]
+
+
+_registry: Dict[str, GuidelineCorpus] = {}
+_registry_lock = threading.Lock()
+# Source mtime per corpus dir whose recompile was declined or failed, so it is not retried per call
+_declined: Dict[str, float] = {}
+# Background recompile in progress per corpus dir
+_recompiling: Dict[str, threading.Thread] = {}
+
+
+def _published_embedder(root: Path, version: str) -> Optional[str]:
+    """Embedder recorded in a published version's manifest, if any"""
+    try:
+        with open(root / version / MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f).get("embedder")
+    except (OSError, ValueError):
+        return None
+
+
+def _recompile(source_path: str, corpus_dir: str, current: Optional[str]) -> bool:
+    """
+    Recompile a changed source, keeping the published version's vectors
+
+    The new version is embedded with the same embedder as the current
+    one. If that embedder cannot be created, the current version stays
+    published rather than being replaced by one without vectors.
+    """
+    embedder_name = _published_embedder(Path(corpus_dir), current) if current else None
+    embedder = None
+    if embedder_name:
+        try:
+            from rag.embedders import get_embedder
+            embedder = get_embedder(embedder_name)
+        except Exception as e:
+            print(f"⚠️ Corpus source changed but embedder '{embedder_name}' is unavailable "
+                  f"({str(e)}); keeping {current}. Run python -m rag.corpus to republish.")
+            return False
+    compile_corpus(source_path, corpus_dir, embedder)
+    return True
+
+
+def _recompile_in_background(key: str, source_path: str, corpus_dir: str,
+                             current: str, source_mtime: float):
+    """
+    Recompile off the request path; current stays published until it succeeds
+
+    Any failure (embedder unavailable, network or API errors while
+    embedding) declines this source mtime, so the next edit retries.
+    """
+    try:
+        published = _recompile(source_path, corpus_dir, current)
+    except Exception as e:
+        print(f"⚠️ Recompiling the corpus from {source_path} failed ({str(e)}); keeping {current}. "
+              f"Run python -m rag.corpus to republish.")
+        published = False
+    with _registry_lock:
+        if not published:
+            _declined[key] = source_mtime
+        _recompiling.pop(key, None)
+
+
+def get_corpus(corpus_dir: str = CORPUS_DIR, source_path: str = CORPUS_SOURCE) -> GuidelineCorpus:
+    """
+    Process-wide corpus for the directory, compiled on first use
+
+    The source is recompiled in a background thread when it is newer
+    than the published version; until that finishes the current version
+    keeps being served, and if it fails it stays published. A newly
+    published version replaces the cached one on the next call. Cheap
+    enough to call per request: only CURRENT and the source are stat'ed
+    unless something changed.
+    """
+    root = Path(corpus_dir)
+    current_file = root / CURRENT_FILE
+
+    with _registry_lock:
+        source = Path(source_path)
+        current = current_file.read_text(encoding='utf-8').strip() if current_file.exists() else None
+        if current is None or not current.startswith(f"v{FORMAT_VERSION}-"):
+            # Vectors from an older format are not reused across formats
+            compile_corpus(source_path, corpus_dir)
+            current = None
+
+        key = str(root.resolve())
+        source_mtime = source.stat().st_mtime if source.exists() else None
+        if (current is not None and source_mtime is not None
+                and source_mtime > current_file.stat().st_mtime
+                and _declined.get(key) != source_mtime and key not in _recompiling):
+            worker = threading.Thread(
+                target=_recompile_in_background, name="corpus-recompile", daemon=True,
+                args=(key, source_path, corpus_dir, current, source_mtime),
+            )
+            _recompiling[key] = worker
+            worker.start()
+
+        version = current_file.read_text(encoding='utf-8').strip()
+        corpus = _registry.get(key)
+        if corpus is None or corpus.version != version:
+            corpus = GuidelineCorpus(root / version)
+            _registry[key] = corpus
+        return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the shared guideline corpus")
+    parser.add_argument("--source", default=CORPUS_SOURCE)
+    parser.add_argument("--out", default=CORPUS_DIR)
+    parser.add_argument("--embedder", help="Also store dense vectors (openai, local, hashing)")
+    args = parser.parse_args()
+
+    embedder = None
+    if args.embedder:
+        from rag.embedders import get_embedder
+        embedder = get_embedder(args.embedder)
+    compile_corpus(args.source, args.out, embedder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Pluggable embedding backends for index building and retrieval
+"""
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import openai
+
+from llm.client import api_key_checked, get_openai_client
+
+DEFAULT_OPENAI_MODEL = "text-embedding-ada-002"
+DEFAULT_LOCAL_MODEL = "all-MiniLM-L6-v2"
+DEFAULT_HASHING_DIM = 384
+
+# Embedder recorded for indexes built before metadata carried it
+LEGACY_EMBEDDER_NAME = f"openai:{DEFAULT_OPENAI_MODEL}"
+
+
+class Embedder:
+    """Base embedder interface: texts in, float32 matrix out"""
+
+    name: str = ""
+    dimension: Optional[int] = None
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embed a single query as a (1, dim) matrix"""
+        return self.embed([text])
+
+
+class OpenAIEmbedder(Embedder):
+    """OpenAI embeddings with token-bounded concurrent batches and backoff"""
+
+    def __init__(self, model: str = None, api_key: str = None):
+        self.model = model or os.getenv('EMBEDDING_MODEL', DEFAULT_OPENAI_MODEL)
+        self.name = f"openai:{self.model}"
+        self.api_key = api_key
+        self.client = get_openai_client(api_key)
+
+        self.max_batch_tokens = int(os.getenv('EMBEDDING_MAX_BATCH_TOKENS', '50000'))
+        self.max_batch_size = int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', '1024'))
+        self.max_concurrency = int(os.getenv('EMBEDDING_MAX_CONCURRENCY', '4'))
+        self.max_retries = int(os.getenv('EMBEDDING_MAX_RETRIES', '6'))
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Rough token count (~4 characters per token for English text)"""
+        return len(text) // 4 + 1
+
+    def make_batches(self, texts: List[str]) -> List[List[int]]:
+        """Group text indices into batches bounded by token count and size"""
+        batches = []
+        current, current_tokens = [], 0
+
+        for i, text in enumerate(texts):
+            tokens = self.estimate_tokens(text)
+            if current and (current_tokens + tokens > self.max_batch_tokens
+                            or len(current) >= self.max_batch_size):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+
+        if current:
+            batches.append(current)
+        return batches
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed one batch, backing off exponentially on rate-limit errors"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                with api_key_checked(self.api_key):
+                    response = self.client.embeddings.create(
+                        model=self.model,
+                        input=texts
+                    )
+                # The API may return items out of order; restore input order
+                return [emb.embedding for emb in sorted(response.data, key=lambda e: e.index)]
+            except openai.RateLimitError:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+                print(f"⏳ Embedding rate limited, retrying in {delay:.1f}s...")
+                time.sleep(delay)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimension or 0), dtype='float32')
+
+        batches = self.make_batches(texts)
+        batch_texts = [[texts[i] for i in batch] for batch in batches]
+
+        if len(batches) == 1:
+            results = [self._embed_batch(batch_texts[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, self.max_concurrency)) as pool:
+                results = list(pool.map(self._embed_batch, batch_texts))
+
+        embeddings = [None] * len(texts)
+        for batch, vectors in zip(batches, results):
+            for i, vector in zip(batch, vectors):
+                embeddings[i] = vector
+
+        matrix = np.asarray(embeddings, dtype='float32')
+        self.dimension = matrix.shape[1]
+        return matrix
+
+
+_local_models: Dict[str, object] = {}
+_local_models_lock = threading.Lock()
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """Local CPU embeddings with a warm, process-wide sentence-transformers model"""
+
+    def __init__(self, model: str = None, batch_size: int = 64):
+        self.model_name = model or os.getenv('LOCAL_EMBEDDING_MODEL', DEFAULT_LOCAL_MODEL)
+        self.name = f"sentence-transformers:{self.model_name}"
+        self.batch_size = batch_size
+        self.model = self._load_model(self.model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    @staticmethod
+    def _load_model(model_name: str):
+        with _local_models_lock:
+            if model_name not in _local_models:
+                from sentence_transformers import SentenceTransformer
+                _local_models[model_name] = SentenceTransformer(model_name, device='cpu')
+            return _local_models[model_name]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dimension), dtype='float32')
+        vectors = self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        return np.asarray(vectors, dtype='float32')
+
+
+class HashingEmbedder(Embedder):
+    """Deterministic feature-hashing embedder for tests and offline use"""
+
+    _token_pattern = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+    def __init__(self, dimension: int = DEFAULT_HASHING_DIM):
+        self.dimension = dimension
+        self.name = f"hashing:{dimension}"
+
+    def _bucket(self, token: str):
+        digest = hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest()
+        value = int.from_bytes(digest, 'little')
+        return value % self.dimension, 1.0 if (value >> 63) & 1 else -1.0
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            for token in self._token_pattern.findall(text.lower()):
+                bucket, sign = self._bucket(token)
+                matrix[row, bucket] += sign
+        return matrix
+
+
+def get_embedder(backend: str = None, api_key: str = None) -> Embedder:
+    """
+    Create an embedder from a backend name or a recorded embedder name
+
+    Accepts 'openai', 'local' or 'hashing' (defaulting to the
+    EMBEDDING_BACKEND setting), or a full name such as
+    'sentence-transformers:all-MiniLM-L6-v2' as stored in index metadata.
+    """
+    backend = backend or os.getenv('EMBEDDING_BACKEND', 'openai')
+    kind, _, option = backend.partition(':')
+
+    if kind == 'openai':
+        return OpenAIEmbedder(model=option or None, api_key=api_key)
+    if kind in ('local', 'sentence-transformers'):
+        return SentenceTransformerEmbedder(model=option or None)
+    if kind == 'hashing':
+        return HashingEmbedder(int(option) if option else DEFAULT_HASHING_DIM)
+
+    raise ValueError(f"Unknown embedding backend: {backend}")
@@ -0,0 +1,70 @@
+"""
+Persistent content-addressed cache of chunk embeddings
+"""
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """SQLite-backed embedding store keyed by (embedding model, text hash)"""
+
+    def __init__(self, path: str = "data/rag/embedding_cache.sqlite"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    text_hash TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, text_hash)
+                )"""
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.path), timeout=30)
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        """Stable content hash for a chunk of text"""
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get_many(self, model: str, hashes: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Return cached float32 vectors for the hashes that are present"""
+        hashes = list(dict.fromkeys(hashes))
+        found = {}
+        with self._lock, self._connect() as conn:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype='float32')
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, np.ndarray]):
+        """Store vectors for the given hashes, replacing existing entries"""
+        rows = [
+            (model, text_hash, int(vec.shape[-1]), np.asarray(vec, dtype='float32').tobytes())
+            for text_hash, vec in vectors.items()
+        ]
+        if not rows:
+            return
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vector) "
+                "VALUES (?, ?, ?, ?)",
+                rows
+            )
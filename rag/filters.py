@@ -0,0 +1,154 @@
+"""
+Metadata filters compiled to id bitsets for FAISS IDSelector search
+"""
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+# Filters are dicts of field -> condition:
+#   {"source": {"NICE NG28", "NICE NG17"}}   membership (set/list/tuple)
+#   {"section": "Lipid management"}          equality
+#   {"updated": {">=": "2022-01-01"}}        comparisons: ==, !=, <, <=, >, >=
+# All conditions must hold. Rows missing the field never match. Fields
+# whose values are all numbers compare numerically; other fields compare
+# as strings, so ordering works for ISO dates but rejects numeric operands.
+_ORDERING = {"<", "<=", ">", ">="}
+_COMPARISONS = {
+    "==": np.equal,
+    "!=": np.not_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+}
+
+
+def _freeze(condition: Any):
+    """Hashable cache key for a condition"""
+    if isinstance(condition, dict):
+        return tuple(sorted((op, _freeze(value)) for op, value in condition.items()))
+    if isinstance(condition, (set, frozenset, list, tuple)):
+        return ("in", tuple(sorted(map(str, condition))))
+    return ("==", condition)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+
+
+class FilterCompiler:
+    """
+    Turn filter dicts into boolean row masks, caching one mask per predicate
+
+    Takes a metadata store with column(field) (only the filtered columns
+    are read) or a plain list of metadata rows.
+    """
+
+    def __init__(self, metadata):
+        self.num_rows = len(metadata)
+        if hasattr(metadata, "column"):
+            self._load_column = metadata.column
+        else:
+            self._load_column = lambda field: [row.get(field) for row in metadata]
+        self._columns: Dict[str, Tuple[bool, np.ndarray, np.ndarray]] = {}
+        self._masks: Dict[Tuple, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _column(self, field: str) -> Tuple[bool, np.ndarray, np.ndarray]:
+        """(numeric, values, present) for a field; numeric when every present value is a number"""
+        column = self._columns.get(field)
+        if column is None:
+            values = self._load_column(field)
+            present = np.array([value is not None for value in values], dtype=bool)
+            numeric = bool(present.any()) and all(_is_number(value) for value in values if value is not None)
+            if numeric:
+                array = np.array([np.nan if value is None else float(value) for value in values], dtype='float64')
+            else:
+                array = np.array(["" if value is None else str(value) for value in values])
+            column = (numeric, array, present)
+            self._columns[field] = column
+        return column
+
+    @staticmethod
+    def _operand(field: str, numeric: bool, operand: Any, ordering: bool = False):
+        """Operand converted to the column type; None if it can never match"""
+        if numeric:
+            try:
+                return float(operand)
+            except (TypeError, ValueError):
+                if ordering:
+                    raise ValueError(f"Filter on numeric field '{field}' needs a numeric operand, got {operand!r}")
+                return None
+        if ordering and _is_number(operand):
+            raise ValueError(f"Field '{field}' is not numeric; ordering filters need a string (e.g. ISO date)")
+        return str(operand)
+
+    def _predicate_mask(self, field: str, condition: Any) -> np.ndarray:
+        numeric, values, present = self._column(field)
+        if isinstance(condition, dict):
+            mask = present.copy()
+            for op, operand in condition.items():
+                if op not in _COMPARISONS:
+                    raise ValueError(f"Unsupported filter operator '{op}' for {field}")
+                operand = self._operand(field, numeric, operand, op in _ORDERING)
+                if operand is None:
+                    # A non-numeric value equals no row of a numeric column
+                    if op != "!=":
+                        mask[:] = False
+                else:
+                    mask &= _COMPARISONS[op](values, operand)
+            return mask
+        if isinstance(condition, (set, frozenset, list, tuple)):
+            operands = [self._operand(field, numeric, value) for value in condition]
+            return present & np.isin(values, [value for value in operands if value is not None])
+        operand = self._operand(field, numeric, condition)
+        if operand is None:
+            return np.zeros(self.num_rows, dtype=bool)
+        return present & (values == operand)
+
+    def compile(self, filters: Dict[str, Any]) -> np.ndarray:
+        """Boolean mask of rows matching every condition"""
+        mask = np.ones(self.num_rows, dtype=bool)
+        with self._lock:
+            for field, condition in filters.items():
+                key = (field, _freeze(condition))
+                predicate = self._masks.get(key)
+                if predicate is None:
+                    predicate = self._predicate_mask(field, condition)
+                    self._masks[key] = predicate
+                mask &= predicate
+        return mask
+
+
+def make_search_params(mask: np.ndarray, index_params: Optional[Dict] = None):
+    """
+    FAISS search parameters restricting search to the rows in the mask
+
+    Returns (params, keepalive): the packed bitmap must stay referenced
+    for as long as the params are used.
+    """
+    bitmap = np.packbits(mask, bitorder='little')
+    selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+    index_params = index_params or {}
+    index_type = index_params.get("type", "flat")
+
+    if index_type.startswith("ivf"):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=index_params.get("nprobe", 1))
+    elif index_type == "hnsw":
+        params = faiss.SearchParametersHNSW(sel=selector, efSearch=index_params.get("efSearch", 16))
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    return params, (bitmap, selector)
+
+
+def parse_filters(text: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Parse a JSON filter setting such as RAG_DEFAULT_FILTERS"""
+    if not text:
+        return None
+    filters = json.loads(text)
+    if not isinstance(filters, dict):
+        raise ValueError("Filters must be a JSON object of field -> condition")
+    return filters
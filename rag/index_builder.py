@@ -5,48 +5,46 @@ import os
 import json
 import numpy as np
 import faiss
-from typing import List, Dict
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Tuple
 from pathlib import Path
-import openai
-from openai import OpenAI
+
+from llm.client import check_api_key_format
+from rag.embedders import Embedder, get_embedder
+from rag.embedding_cache import EmbeddingCache
+from rag.index_factory import build_faiss_index, choose_index_params
+from rag.chunker import TokenChunker
+from rag.corpus import get_corpus
+from rag.metadata_store import write_metadata_db
+from rag.snapshots import abort_snapshot, begin_snapshot, publish_snapshot, resolve_snapshot
+from rag.text_store import TextStoreWriter
+from rag.query_embeddings import build_query_table
+
+# Chunks embedded and written per step when streaming into the index
+STREAM_BATCH_SIZE = 256
 
 class RAGIndexBuilder:
     """Build and manage FAISS index for diabetes guidelines"""
     
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, embedder: Embedder = None):
+        # Get API key from parameter or environment variable
+        self.api_key = api_key or os.getenv('OPENAI_API_KEY')
         try:
-            # Get API key from parameter or environment variable
-            self.api_key = api_key or os.getenv('OPENAI_API_KEY')
-            if not self.api_key:
-                raise ValueError("No OpenAI API key found. Please set the OPENAI_API_KEY environment variable.")
-            
-            # Verify the API key format (starts with 'sk-' or 'sk-proj-')
-            if not (self.api_key.startswith('sk-') or self.api_key.startswith('sk-proj-')):
-                raise ValueError("Invalid API key format. It should start with 'sk-' or 'sk-proj-'")
-            
-            # Initialize OpenAI client
-            self.client = OpenAI(api_key=self.api_key)
-            
-            # Test the API key with a simple request
-            try:
-                models = self.client.models.list()
-                if not models.data:
-                    raise ValueError("API key is invalid or has no access to models")
-            except Exception as e:
-                if "Incorrect API key" in str(e):
-                    raise ValueError("The provided API key is invalid or revoked.")
-                elif "Rate limit" in str(e):
-                    raise ValueError("API rate limit exceeded. Please try again later.")
-                else:
-                    raise ValueError(f"Failed to verify API key: {str(e)}")
-            
-            # Set embedding model
-            self.embedding_model = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
-            self.chunk_size = 1000
-            self.overlap = 200
-            
-            # Log successful initialization (without exposing the key)
-            print("✅ Successfully initialized OpenAI client")
+            if embedder is None:
+                backend = os.getenv('EMBEDDING_BACKEND', 'openai')
+                # Offline format check only; the key is proven by the first embedding call
+                if backend.startswith('openai'):
+                    check_api_key_format(self.api_key)
+                embedder = get_embedder(backend, api_key=self.api_key)
+            
+            # Embedder name doubles as the embedding cache namespace
+            self.embedder = embedder
+            self.embedding_model = embedder.name
+            self.chunker = TokenChunker()
+            self.embedding_cache = EmbeddingCache()
+            
+            print(f"✅ Successfully initialized embedder: {self.embedding_model}")
             
         except Exception as e:
             error_msg = str(e)
@@ -54,139 +52,188 @@ class RAGIndexBuilder:
             if self.api_key and len(self.api_key) > 8:
                 error_msg = error_msg.replace(self.api_key, f"{self.api_key[:4]}...{self.api_key[-4:]}")
             raise ValueError(f"Failed to initialize RAGIndexBuilder: {error_msg}")
-        
+    
     def load_guidelines(self) -> List[Dict]:
-        """Load curated NICE/BDA text snippets"""
-        guidelines = [
-            {
-                "id": "nice_ng17_hba1c",
-                "source": "NICE NG17",
-                "section": "Blood glucose management",
-                "text": """Adults with type 1 diabetes should aim for HbA1c level of 48 mmol/mol (6.5%) or lower to minimise the risk of long-term vascular complications. However, this target should be individualised based on factors including hypoglycaemia awareness, occupational considerations, and presence of complications. For adults at higher risk of severe hypoglycaemia or with limited life expectancy, less stringent targets of 53 mmol/mol (7.0%) may be appropriate."""
-            },
-            {
-                "id": "nice_ng28_bp",
-                "source": "NICE NG28", 
-                "section": "Blood pressure management",
-                "text": """For adults with type 2 diabetes, offer antihypertensive drug treatment if blood pressure is consistently above 140/90 mmHg. The target blood pressure should be below 140/90 mmHg (below 130/80 mmHg if kidney, eye or cerebrovascular damage is present). ACE inhibitors or ARBs are first-line treatment for adults with diabetes and hypertension."""
-            },
-            {
-                "id": "nice_ng28_lipids",
-                "source": "NICE NG28",
-                "section": "Lipid management", 
-                "text": """Offer atorvastatin 20mg to adults with type 2 diabetes who have a 10-year cardiovascular risk of 10% or more. For primary prevention, aim for more than 40% reduction in non-HDL cholesterol. For secondary prevention, the target LDL cholesterol is less than 2.0 mmol/L. Consider higher intensity statin if targets not achieved."""
-            },
-            {
-                "id": "bda_carb_counting",
-                "source": "BDA Guidelines",
-                "section": "Carbohydrate counting",
-                "text": """Carbohydrate counting enables flexible meal planning and improved glycaemic control in people with type 1 diabetes using intensive insulin regimens. One carbohydrate portion typically contains 10-15g of carbohydrate. Insulin-to-carbohydrate ratios typically range from 1:8 to 1:15 but must be individualised. Regular review and adjustment is essential."""
-            },
-            {
-                "id": "nice_ng17_hypo",
-                "source": "NICE NG17",
-                "section": "Hypoglycaemia management",
-                "text": """Severe hypoglycaemia should be avoided as it increases cardiovascular risk and impairs quality of life. Adults experiencing frequent non-severe hypoglycaemia or any severe hypoglycaemia should have their treatment regimen reviewed. Consider structured education, glucose monitoring technology, and insulin regimen optimisation. Emergency glucagon should be prescribed for those at risk of severe hypoglycaemia."""
-            },
-            {
-                "id": "nice_screening",
-                "source": "NICE Diabetes Screening",
-                "section": "Annual screening",
-                "text": """Annual screening should include: diabetic retinopathy (digital photography), diabetic kidney disease (eGFR and ACR), foot assessment (neuropathy and vascular status), blood pressure monitoring, and lipid profile. Influenza vaccination should be offered annually, with pneumococcal vaccination every 5 years for adults with diabetes."""
-            }
+        """Load NICE/BDA guideline documents from the shared corpus"""
+        return [
+            {key: doc[key] for key in ("id", "source", "section", "updated", "text")}
+            for doc in get_corpus().documents
         ]
-        return guidelines
         
     def chunk_text(self, text: str) -> List[str]:
-        """Split text into overlapping chunks"""
-        words = text.split()
-        chunks = []
-        
-        for i in range(0, len(words), self.chunk_size - self.overlap):
-            chunk_words = words[i:i + self.chunk_size]
-            chunks.append(' '.join(chunk_words))
-            
-        return chunks
+        """Split text into token-bounded, sentence-aligned overlapping chunks"""
+        return [text[span.start:span.end] for span in self.chunker.spans(text)]
     
     def get_embeddings(self, texts: List[str]) -> np.ndarray:
-        """Get embeddings for text chunks"""
-        response = self.client.embeddings.create(
-            model=self.embedding_model,
-            input=texts
-        )
-        return np.array([emb.embedding for emb in response.data])
+        """Get embeddings for text chunks from the configured embedder"""
+        return self.embedder.embed(texts)
+    
+    def embed_with_cache(self, texts: List[str]) -> np.ndarray:
+        """Embed texts, calling the API only for chunks not already cached"""
+        hashes = [EmbeddingCache.text_hash(text) for text in texts]
+        cached = self.embedding_cache.get_many(self.embedding_model, hashes)
+        
+        missing = {}
+        for text_hash, text in zip(hashes, texts):
+            if text_hash not in cached and text_hash not in missing:
+                missing[text_hash] = text
+        
+        print(f"🗃️ Embedding cache: {len(hashes) - len(missing)} hits, {len(missing)} to embed")
+        if missing:
+            new_vectors = np.asarray(self.get_embeddings(list(missing.values())), dtype='float32')
+            fresh = dict(zip(missing.keys(), new_vectors))
+            self.embedding_cache.put_many(self.embedding_model, fresh)
+            cached.update(fresh)
+        
+        return np.vstack([cached[text_hash] for text_hash in hashes]).astype('float32')
+    
+    def _report_changes(self, save_path: str, metadata: List[Dict]):
+        """Summarise added/changed/removed chunks against the previous build"""
+        metadata_file = Path(save_path) / "metadata.json"
+        if not metadata_file.exists():
+            return
+        
+        with open(metadata_file, 'r', encoding='utf-8') as f:
+            previous = {m['id']: m.get('text_hash') for m in json.load(f)}
+        current = {m['id']: m['text_hash'] for m in metadata}
+        
+        added = len(current.keys() - previous.keys())
+        removed = len(previous.keys() - current.keys())
+        changed = sum(1 for chunk_id in current.keys() & previous.keys()
+                      if current[chunk_id] != previous[chunk_id])
+        print(f"🔁 Incremental rebuild: {added} new, {changed} changed, {removed} removed chunks")
+    
+    def iter_chunks(self, guidelines: Iterable[Dict]) -> Iterator[Tuple[str, Dict]]:
+        """Stream (chunk text, metadata) pairs; chunks never cross a section"""
+        for guideline in guidelines:
+            text = guideline['text']
+            for i, span in enumerate(self.chunker.spans(text)):
+                chunk = text[span.start:span.end]
+                yield chunk, {
+                    "id": f"{guideline['id']}_chunk_{i}",
+                    "source": guideline['source'],
+                    "section": guideline['section'],
+                    "updated": guideline.get('updated'),
+                    "tokens": span.tokens,
+                    "text_hash": EmbeddingCache.text_hash(chunk)
+                }
+    
+    def _embed_stream(self, chunks: Iterable[Tuple[str, Dict]], vectors_file: Path,
+                      text_writer: TextStoreWriter) -> Tuple[List[Dict], int]:
+        """
+        Embed chunks batch by batch, spilling normalised vectors to disk
+        
+        Chunk text goes straight to the text store and vectors to a raw
+        float32 file, so only one batch of text and vectors is in memory.
+        Returns the chunk metadata and the vector dimension.
+        """
+        metadata = []
+        dimension = 0
+        with open(vectors_file, 'wb') as spill:
+            for batch in _batched(chunks, STREAM_BATCH_SIZE):
+                texts = [text for text, _ in batch]
+                embeddings = np.ascontiguousarray(self.embed_with_cache(texts), dtype='float32')
+                faiss.normalize_L2(embeddings)
+                dimension = embeddings.shape[1]
+                spill.write(embeddings.tobytes())
+                text_writer.add_many(texts)
+                metadata.extend(meta for _, meta in batch)
+        return metadata, dimension
     
-    def build_index(self, save_path: str = "data/rag"):
-        """Build FAISS index from guidelines with proper vector normalization"""
+    def build_index(self, save_path: str = "data/rag", guidelines: Iterable[Dict] = None):
+        """
+        Build FAISS index from guidelines with proper vector normalization
+        
+        Guidelines default to the shared corpus; any iterable of guideline
+        dicts (id, source, section, updated, text) can be streamed in, e.g.
+        from rag.ingest, without materialising the whole corpus.
+        
+        Everything is written to a staging snapshot under save_path and
+        published atomically, so running retrievers never see a partial
+        index; they pick up the new version on their next reload check.
+        """
+        snapshot_dir = None
         try:
-            # Load guidelines
-            guidelines = self.load_guidelines()
-            if not guidelines:
-                raise ValueError("No guidelines found to index")
+            if guidelines is None:
+                guidelines = self.load_guidelines()
             
-            # Prepare chunks and metadata
-            all_chunks = []
-            metadata = []
+            os.makedirs(save_path, exist_ok=True)
+            snapshot_dir = begin_snapshot(save_path)
+            vectors_file = snapshot_dir / "vectors.f32.tmp"
             
+            # Chunk, embed (only new or changed chunks hit the API) and spill
             print("📚 Processing guidelines...")
-            for guideline in guidelines:
-                chunks = self.chunk_text(guideline['text'])
-                for i, chunk in enumerate(chunks):
-                    all_chunks.append(chunk)
-                    metadata.append({
-                        "id": f"{guideline['id']}_chunk_{i}",
-                        "source": guideline['source'],
-                        "section": guideline['section']
-                    })
-            
-            if not all_chunks:
-                raise ValueError("No text chunks were generated from guidelines")
-            
-            # Generate embeddings
-            print(f"🔄 Generating embeddings for {len(all_chunks)} text chunks...")
-            embeddings = self.get_embeddings(all_chunks)
-            
-            # Convert to numpy array and ensure float32
-            import numpy as np
-            embeddings = np.array(embeddings).astype('float32')
-            
-            # Normalize vectors to unit length (L2 norm)
-            print("📏 Normalizing vectors...")
-            faiss.normalize_L2(embeddings)
-            
-            # Get vector dimension
-            dimension = embeddings.shape[1]
-            print(f"🔢 Vector dimension: {dimension}")
-            
-            # Create FAISS index with inner product (cosine) similarity
-            print("🏗️ Creating FAISS index...")
-            index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
-            
-            # Add vectors to index
+            with TextStoreWriter(str(snapshot_dir)) as text_writer:
+                metadata, dimension = self._embed_stream(
+                    self.iter_chunks(guidelines), vectors_file, text_writer
+                )
+                if not metadata:
+                    raise ValueError("No text chunks were generated from guidelines")
+            
+            self._report_changes(str(resolve_snapshot(save_path)[1]), metadata)
+            print(f"🔢 Embedded {len(metadata)} chunks, vector dimension: {dimension}")
+            embeddings = np.memmap(vectors_file, dtype='float32', mode='r',
+                                   shape=(len(metadata), dimension))
+            
+            # Choose index type from corpus size and memory budget
+            index_params = choose_index_params(len(embeddings), dimension)
+            print(f"🏗️ Creating FAISS index ({index_params['type']})...")
+            
+            # Train on a sample (IVF types) and add vectors
             print("📥 Adding vectors to index...")
-            index.add(embeddings)
+            index = build_faiss_index(embeddings, index_params)
+            del embeddings
+            vectors_file.unlink()
             
             # Verify index
             if index.ntotal == 0:
                 raise ValueError("Failed to add vectors to index")
             
-            # Create output directory if it doesn't exist
-            os.makedirs(save_path, exist_ok=True)
-            
             # Save index
-            faiss.write_index(index, f"{save_path}/index.faiss")
+            faiss.write_index(index, str(snapshot_dir / "index.faiss"))
             
             # Save metadata
-            with open(f"{save_path}/metadata.json", 'w', encoding='utf-8') as f:
+            with open(snapshot_dir / "metadata.json", 'w', encoding='utf-8') as f:
                 json.dump(metadata, f, indent=2, ensure_ascii=False)
             
-            print(f"✅ Index built with {index.ntotal} vectors and saved to {save_path}")
+            # Offset-indexed metadata store read lazily by retrievers
+            write_metadata_db(metadata, str(snapshot_dir))
+            
+            # Record which embedder built the index so retrievers can check it
+            index_info = {
+                "embedder": self.embedder.name,
+                "dimension": dimension,
+                "num_vectors": int(index.ntotal),
+                "index_params": index_params,
+                "built_at": datetime.now().isoformat(timespec='seconds')
+            }
+            with open(snapshot_dir / "index_info.json", 'w', encoding='utf-8') as f:
+                json.dump(index_info, f, indent=2)
+            
+            # Precompute embeddings for every query the retriever can build
+            query_count = build_query_table(self.embedder, str(snapshot_dir), self.embedding_cache)
+            print(f"🧭 Precomputed {query_count} retrieval query embeddings")
+            
+            version = publish_snapshot(save_path, snapshot_dir)
+            print(f"✅ Index built with {index.ntotal} vectors and published to {save_path} as {version}")
             return index, metadata
             
         except Exception as e:
+            if snapshot_dir is not None:
+                abort_snapshot(snapshot_dir)
             print(f"❌ Error building index: {str(e)}")
             raise
 
+
+def _batched(items: Iterable, size: int) -> Iterator[List]:
+    """Group an iterable into lists of at most size items"""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
 if __name__ == "__main__":
     builder = RAGIndexBuilder()
     builder.build_index()
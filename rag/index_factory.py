@@ -0,0 +1,195 @@
+"""
+FAISS index selection, construction and search-time tuning
+"""
+import math
+import os
+from typing import Dict, Optional
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+VECTOR_ENCODINGS = ("float32", "float16", "int8")
+
+# Bytes per vector component for each stored encoding
+_ENCODING_BYTES = {"float32": 4, "float16": 2, "int8": 1}
+_SQ_TYPES = {
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# Below this size brute force is fast enough and exact
+FLAT_MAX_VECTORS = 20_000
+# HNSW graphs get slow to build and heavy beyond this size
+HNSW_MAX_VECTORS = 500_000
+HNSW_M = 32
+# Vectors copied into the index per add() call
+ADD_BATCH_SIZE = 65_536
+
+
+def _ivf_nlist(n_vectors: int) -> int:
+    """Rule-of-thumb IVF list count (~4 * sqrt(n)), at least 39 points per list"""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
+
+
+def _pq_subquantizers(dimension: int) -> int:
+    """Largest divisor of the dimension giving >= 4 dims per sub-quantizer"""
+    for m in (96, 64, 48, 32, 24, 16, 12, 8, 4, 2, 1):
+        if dimension % m == 0 and dimension // m >= 4:
+            return m
+    return 1
+
+
+def estimate_memory_mb(index_type: str, n_vectors: int, dimension: int,
+                       encoding: str = "float32") -> float:
+    """Approximate resident size of an index in MB"""
+    flat_bytes = n_vectors * dimension * _ENCODING_BYTES[encoding]
+    if index_type == "flat":
+        size = flat_bytes
+    elif index_type == "hnsw":
+        size = flat_bytes + n_vectors * HNSW_M * 2 * 4
+    elif index_type == "ivf_flat":
+        size = flat_bytes + n_vectors * 8
+    elif index_type == "ivf_pq":
+        size = n_vectors * (_pq_subquantizers(dimension) + 8)
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+    return size / (1024 * 1024)
+
+
+def choose_index_params(n_vectors: int, dimension: int,
+                        memory_budget_mb: float = None,
+                        index_type: str = None,
+                        encoding: str = None) -> Dict:
+    """
+    Pick an index type and its parameters for the corpus size
+
+    Small corpora stay exact (flat). Larger ones use HNSW if it fits in
+    the memory budget, then IVF-Flat, and IVF-PQ when even raw vectors
+    would not fit. RAG_INDEX_TYPE forces a type. RAG_VECTOR_ENCODING
+    stores vectors as float32, float16 or int8 (scalar quantized).
+    """
+    if memory_budget_mb is None:
+        memory_budget_mb = float(os.getenv('RAG_INDEX_MEMORY_MB', '1024'))
+    index_type = index_type or os.getenv('RAG_INDEX_TYPE', 'auto')
+    encoding = encoding or os.getenv('RAG_VECTOR_ENCODING', 'float32')
+    if encoding not in VECTOR_ENCODINGS:
+        raise ValueError(f"Unknown vector encoding: {encoding}")
+
+    if index_type == 'auto':
+        def fits(kind):
+            return estimate_memory_mb(kind, n_vectors, dimension, encoding) <= memory_budget_mb
+
+        if n_vectors <= FLAT_MAX_VECTORS and fits("flat"):
+            index_type = "flat"
+        elif n_vectors <= HNSW_MAX_VECTORS and fits("hnsw"):
+            index_type = "hnsw"
+        elif fits("ivf_flat"):
+            index_type = "ivf_flat"
+        else:
+            index_type = "ivf_pq"
+
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    params = {"type": index_type, "metric": "inner_product"}
+    if index_type != "ivf_pq":
+        # PQ codes are already compressed; other types store scalar codes
+        params["encoding"] = encoding
+    if index_type == "hnsw":
+        params.update({"M": HNSW_M, "efConstruction": 80, "efSearch": 64})
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = _ivf_nlist(n_vectors)
+        params.update({"nlist": nlist, "nprobe": min(nlist, max(8, nlist // 16))})
+        if index_type == "ivf_pq":
+            params.update({"pq_m": _pq_subquantizers(dimension), "pq_nbits": 8})
+        # faiss wants ~39-256 training points per centroid
+        params["train_size"] = min(n_vectors, params["nlist"] * 256)
+    elif encoding == "int8":
+        # int8 ranges are learned from a sample
+        params["train_size"] = min(n_vectors, 100_000)
+
+    params["estimated_memory_mb"] = round(
+        estimate_memory_mb(index_type, n_vectors, dimension, params.get("encoding", "float32")), 2
+    )
+    return params
+
+
+def create_index(params: Dict, dimension: int) -> faiss.Index:
+    """Create an empty inner-product index from saved parameters"""
+    index_type = params["type"]
+    metric = faiss.METRIC_INNER_PRODUCT
+    sq_type = _SQ_TYPES.get(params.get("encoding", "float32"))
+
+    if index_type == "flat":
+        if sq_type is not None:
+            return faiss.IndexScalarQuantizer(dimension, sq_type, metric)
+        return faiss.IndexFlatIP(dimension)
+    if index_type == "hnsw":
+        if sq_type is not None:
+            index = faiss.IndexHNSWSQ(dimension, sq_type, params["M"], metric)
+        else:
+            index = faiss.IndexHNSWFlat(dimension, params["M"], metric)
+        index.hnsw.efConstruction = params["efConstruction"]
+        return index
+
+    quantizer = faiss.IndexFlatIP(dimension)
+    if index_type == "ivf_flat":
+        if sq_type is not None:
+            return faiss.IndexIVFScalarQuantizer(quantizer, dimension, params["nlist"],
+                                                 sq_type, metric)
+        return faiss.IndexIVFFlat(quantizer, dimension, params["nlist"], metric)
+    if index_type == "ivf_pq":
+        return faiss.IndexIVFPQ(quantizer, dimension, params["nlist"],
+                                params["pq_m"], params["pq_nbits"], metric)
+
+    raise ValueError(f"Unknown index type: {index_type}")
+
+
+def train_index(index: faiss.Index, vectors: np.ndarray, params: Dict, seed: int = 1234):
+    """Train the index on a random sample of the vectors if it needs training"""
+    if index.is_trained:
+        return
+    sample_size = min(len(vectors), params.get("train_size", len(vectors)))
+    rng = np.random.default_rng(seed)
+    sample = vectors[np.sort(rng.choice(len(vectors), size=sample_size, replace=False))]
+    index.train(np.ascontiguousarray(sample, dtype='float32'))
+
+
+def build_faiss_index(vectors: np.ndarray, params: Dict) -> faiss.Index:
+    """Create, train and fill an index with normalised float32 vectors (array or memmap)"""
+    index = create_index(params, vectors.shape[1])
+    train_index(index, vectors, params)
+    # Add in blocks so memory-mapped input is never copied whole
+    for start in range(0, len(vectors), ADD_BATCH_SIZE):
+        index.add(np.ascontiguousarray(vectors[start:start + ADD_BATCH_SIZE], dtype='float32'))
+    apply_search_params(index, params)
+    return index
+
+
+def apply_search_params(index: faiss.Index, params: Optional[Dict]):
+    """Apply saved search-time parameters (nprobe, efSearch) to a loaded index"""
+    if not params:
+        return
+    space = faiss.ParameterSpace()
+    if "nprobe" in params:
+        space.set_index_parameter(index, "nprobe", params["nprobe"])
+    if "efSearch" in params:
+        space.set_index_parameter(index, "efSearch", params["efSearch"])
+
+
+def read_index_mmap(path: str) -> faiss.Index:
+    """
+    Open an index read-only and memory-mapped where faiss supports it
+
+    With mmap the vector codes stay in the OS page cache and are shared
+    by every worker process instead of being copied into each one.
+    """
+    flags = faiss.IO_FLAG_READ_ONLY
+    for mmap_flag in ("IO_FLAG_MMAP_IFC", "IO_FLAG_MMAP"):
+        if hasattr(faiss, mmap_flag):
+            try:
+                return faiss.read_index(path, getattr(faiss, mmap_flag) | flags)
+            except RuntimeError:
+                continue
+    return faiss.read_index(path)
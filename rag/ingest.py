@@ -0,0 +1,291 @@
+"""
+Ingest a directory of guideline documents (PDF, HTML, markdown) into the RAG index
+
+Files are parsed in a process pool into heading-delimited sections, and
+the sections stream through the builder's chunker into embedding and
+indexing, so only the files currently being parsed are held in memory.
+
+Usage:
+    python -m rag.ingest guidelines/ [--out data/rag] [--with-corpus]
+"""
+import argparse
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+SUPPORTED_EXTENSIONS = {".pdf", ".html", ".htm", ".md", ".markdown", ".txt"}
+# A PDF line is a heading when its font is this much larger than body text
+PDF_HEADING_SCALE = 1.15
+MAX_HEADING_CHARS = 120
+
+_NICE_CODE = re.compile(r"\b(ng|cg|qs|ta)[\s_-]?(\d+)\b", re.IGNORECASE)
+_MARKDOWN_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_FRONT_MATTER_DATE = re.compile(r"^(updated|last_updated|modified|date)\s*:\s*(.+?)\s*$", re.IGNORECASE)
+# YYYY-MM-DD, YYYYMMDD or PDF 'D:YYYYMMDD...' dates, optionally followed by a time
+_DATE = re.compile(r"(\d{4})-?(\d{2})-?(\d{2})")
+# Front matter keys and HTML meta names for the revision date, most specific first
+_DATE_KEYS = ("updated", "last_updated", "modified", "date")
+_HTML_DATE_META = ("dcterms.modified", "article:modified_time", "last-modified", "dc.date.modified",
+                   "dcterms.issued", "article:published_time", "dc.date", "date")
+
+
+def discover_files(directory: str) -> List[Path]:
+    """Supported guideline files under the directory, in a stable order"""
+    return sorted(
+        path for path in Path(directory).rglob("*")
+        if path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS
+    )
+
+
+def infer_source(path: Path, title: str = "") -> str:
+    """Source label such as 'NICE NG28' from the file name or title"""
+    match = _NICE_CODE.search(path.stem) or _NICE_CODE.search(title)
+    if match:
+        return f"NICE {match.group(1).upper()}{match.group(2)}"
+    return path.stem.replace("_", " ").replace("-", " ").strip().title()
+
+
+def _iso_date(value) -> Optional[str]:
+    """ISO date from a front matter, meta tag or PDF metadata value, if it holds one"""
+    match = _DATE.search(str(value or ""))
+    if not match:
+        return None
+    try:
+        return datetime(*(int(part) for part in match.groups())).date().isoformat()
+    except ValueError:
+        return None
+
+
+def _section(heading: str, lines: List[str]) -> Optional[Dict]:
+    text = " ".join(line.strip() for line in lines if line.strip())
+    return {"section": heading, "text": text} if text else None
+
+
+def _read_front_matter(f) -> Dict[str, str]:
+    """Consume a leading '---' front matter block, returning its date fields"""
+    first = f.readline()
+    if first.strip() != "---":
+        f.seek(0)
+        return {}
+    fields = {}
+    for line in f:
+        if line.strip() in ("---", "..."):
+            return fields
+        match = _FRONT_MATTER_DATE.match(line)
+        if match:
+            fields[match.group(1).lower()] = match.group(2).strip("'\"")
+    # Unterminated: not front matter after all
+    f.seek(0)
+    return {}
+
+
+def _parse_markdown(path: Path) -> Dict:
+    sections, heading, lines, title = [], "Introduction", [], ""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        front_matter = _read_front_matter(f)
+        for line in f:
+            match = _MARKDOWN_HEADING.match(line)
+            if match:
+                section = _section(heading, lines)
+                if section:
+                    sections.append(section)
+                heading, lines = match.group(2), []
+                title = title or heading
+            else:
+                lines.append(line)
+    section = _section(heading, lines)
+    if section:
+        sections.append(section)
+    updated = next((_iso_date(front_matter[key]) for key in _DATE_KEYS if _iso_date(front_matter.get(key))), None)
+    return {"title": title, "updated": updated, "sections": sections}
+
+
+def _parse_html(path: Path) -> Dict:
+    from bs4 import BeautifulSoup
+
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        soup = BeautifulSoup(f.read(), "html.parser")
+    for tag in soup(["script", "style", "nav", "header", "footer", "aside"]):
+        tag.decompose()
+
+    title = soup.title.get_text(strip=True) if soup.title else ""
+    meta = {}
+    for tag in soup.find_all("meta"):
+        name = (tag.get("name") or tag.get("property") or tag.get("http-equiv") or "").lower()
+        if name and tag.get("content"):
+            meta.setdefault(name, tag["content"])
+    updated = next((_iso_date(meta[name]) for name in _HTML_DATE_META if _iso_date(meta.get(name))), None)
+
+    sections, heading, lines = [], title or "Introduction", []
+    for element in soup.find_all(["h1", "h2", "h3", "h4", "p", "li", "td"]):
+        # Nested blocks are already part of their enclosing block's text
+        if element.find_parent(["p", "li", "td"]):
+            continue
+        text = element.get_text(" ", strip=True)
+        if not text:
+            continue
+        if element.name.startswith("h"):
+            section = _section(heading, lines)
+            if section:
+                sections.append(section)
+            heading, lines = text, []
+        else:
+            lines.append(text)
+    section = _section(heading, lines)
+    if section:
+        sections.append(section)
+    return {"title": title, "updated": updated, "sections": sections}
+
+
+def _parse_pdf(path: Path) -> Dict:
+    import fitz  # PyMuPDF
+
+    doc = fitz.open(str(path))
+    try:
+        # (text, font size) per line; body size is the most common by characters
+        page_lines = []
+        size_chars = Counter()
+        for page in doc:
+            for block in page.get_text("dict")["blocks"]:
+                for line in block.get("lines", []):
+                    spans = [span for span in line["spans"] if span["text"].strip()]
+                    if not spans:
+                        continue
+                    text = " ".join(span["text"].strip() for span in spans)
+                    size = round(max(span["size"] for span in spans), 1)
+                    size_chars[size] += len(text)
+                    page_lines.append((text, size))
+        metadata = doc.metadata or {}
+        title = metadata.get("title") or ""
+        updated = _iso_date(metadata.get("modDate")) or _iso_date(metadata.get("creationDate"))
+    finally:
+        doc.close()
+
+    body_size = size_chars.most_common(1)[0][0] if size_chars else 0
+    sections, heading, lines = [], title or "Introduction", []
+    for text, size in page_lines:
+        if size >= body_size * PDF_HEADING_SCALE and len(text) <= MAX_HEADING_CHARS:
+            section = _section(heading, lines)
+            if section:
+                sections.append(section)
+            heading, lines = text, []
+        else:
+            lines.append(text)
+    section = _section(heading, lines)
+    if section:
+        sections.append(section)
+    return {"title": title, "updated": updated, "sections": sections}
+
+
+def document_id(path: Path, root: Path = None) -> str:
+    """Stable id from the path relative to the ingest root, suffix included"""
+    relative = path.relative_to(root) if root else Path(path.name)
+    return re.sub(r"[^a-z0-9]+", "_", relative.as_posix().lower()).strip("_")
+
+
+def parse_file(path: Path, root: Path = None) -> Dict:
+    """
+    Parse one guideline file into a document with heading-delimited sections
+
+    Runs in worker processes, so it only takes and returns plain data. The
+    revision date comes from the document's own metadata (front matter,
+    meta tags, PDF info); the file mtime is only a fallback, as copies and
+    checkouts reset it.
+    """
+    suffix = path.suffix.lower()
+    if suffix == ".pdf":
+        parsed = _parse_pdf(path)
+    elif suffix in (".html", ".htm"):
+        parsed = _parse_html(path)
+    else:
+        parsed = _parse_markdown(path)
+
+    title = parsed["title"] or path.stem
+    updated = parsed["updated"]
+    if not updated:
+        updated = datetime.fromtimestamp(path.stat().st_mtime).date().isoformat()
+        print(f"⚠️ No revision date in {path}; using file modification date {updated}")
+    return {
+        "id": document_id(path, root),
+        "source": infer_source(path, title),
+        "title": title,
+        "updated": updated,
+        "sections": parsed["sections"],
+    }
+
+
+def iter_parsed_documents(paths: List[Path], workers: int = None, root: str = None) -> Iterator[Dict]:
+    """
+    Parse files in a process pool, yielding documents in input order
+
+    Document ids are built from each path relative to root, so files with
+    the same name in different folders or formats stay distinct.
+
+    At most two files per worker are in flight, so parsed text does not
+    pile up ahead of the chunking and embedding stages.
+    """
+    workers = workers or os.cpu_count() or 1
+    root = Path(root) if root else None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        for path in paths:
+            pending.append((path, executor.submit(parse_file, path, root)))
+            if len(pending) >= workers * 2:
+                yield from _collect(*pending.pop(0))
+        for path, future in pending:
+            yield from _collect(path, future)
+
+
+def _collect(path: Path, future) -> Iterator[Dict]:
+    try:
+        document = future.result()
+    except Exception as e:
+        print(f"⚠️ Skipping {path}: {str(e)}")
+        return
+    print(f"📄 Parsed {path.name}: {len(document['sections'])} sections")
+    yield document
+
+
+def iter_guidelines(documents: Iterator[Dict]) -> Iterator[Dict]:
+    """Flatten parsed documents into per-section guidelines for the index builder"""
+    for document in documents:
+        for i, section in enumerate(document["sections"]):
+            yield {
+                "id": f"{document['id']}_s{i}",
+                "source": document["source"],
+                "section": section["section"],
+                "updated": document["updated"],
+                "text": section["text"],
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index a directory of guideline documents")
+    parser.add_argument("directory", help="Directory of PDF, HTML and markdown guidelines")
+    parser.add_argument("--out", default="data/rag", help="Index output directory")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes")
+    parser.add_argument("--with-corpus", action="store_true",
+                        help="Also index the curated guideline corpus")
+    args = parser.parse_args()
+
+    from rag.index_builder import RAGIndexBuilder
+
+    paths = discover_files(args.directory)
+    if not paths:
+        raise SystemExit(f"No guideline files found in {args.directory}")
+    print(f"📚 Ingesting {len(paths)} files from {args.directory}")
+
+    builder = RAGIndexBuilder()
+    guidelines = iter_guidelines(iter_parsed_documents(paths, args.workers, root=args.directory))
+    if args.with_corpus:
+        from itertools import chain
+        guidelines = chain(builder.load_guidelines(), guidelines)
+    builder.build_index(args.out, guidelines=guidelines)
+
+
+if __name__ == "__main__":
+    main()
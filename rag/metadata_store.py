@@ -0,0 +1,136 @@
+"""
+Chunk metadata stores read lazily per search hit
+"""
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List
+
+METADATA_DB_FILE = "metadata.sqlite"
+METADATA_JSON_FILE = "metadata.json"
+
+# Columns stored directly; any other keys go into the JSON 'extra' column
+_COLUMNS = ("id", "source", "section", "text_hash")
+
+
+def write_metadata_db(metadata: List[Dict], save_path: str):
+    """Write metadata rows keyed by their FAISS row number"""
+    db_file = Path(save_path) / METADATA_DB_FILE
+    tmp_file = db_file.with_suffix(".sqlite.tmp")
+    if tmp_file.exists():
+        tmp_file.unlink()
+
+    conn = sqlite3.connect(str(tmp_file))
+    try:
+        conn.execute(
+            """CREATE TABLE chunks (
+                row INTEGER PRIMARY KEY,
+                id TEXT NOT NULL,
+                source TEXT,
+                section TEXT,
+                text_hash TEXT,
+                extra TEXT
+            )"""
+        )
+        conn.executemany(
+            "INSERT INTO chunks (row, id, source, section, text_hash, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (row, *(meta.get(col) for col in _COLUMNS),
+                 json.dumps({k: v for k, v in meta.items() if k not in _COLUMNS}))
+                for row, meta in enumerate(metadata)
+            )
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    tmp_file.replace(db_file)
+
+
+class JSONMetadataStore:
+    """Metadata list loaded from metadata.json (indexes built before SQLite)"""
+
+    def __init__(self, metadata_file: Path):
+        with open(metadata_file, 'r', encoding='utf-8') as f:
+            self._rows = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def get_many(self, rows: List[int]) -> List[Dict]:
+        return [self._rows[row].copy() for row in rows]
+
+    def all(self) -> List[Dict]:
+        return [row.copy() for row in self._rows]
+
+    def column(self, field: str) -> List[Any]:
+        """One field for every row, in row order (None where missing)"""
+        return [row.get(field) for row in self._rows]
+
+
+class SQLiteMetadataStore:
+    """Read-only metadata lookups; only the rows for search hits are loaded"""
+
+    def __init__(self, db_file: Path):
+        self.db_file = Path(db_file)
+        self._local = threading.local()
+        self._count = self._conn().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections are per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    def __len__(self) -> int:
+        return self._count
+
+    @staticmethod
+    def _to_dict(record) -> Dict:
+        row_id, chunk_id, source, section, text_hash, extra = record
+        meta = {"id": chunk_id, "source": source, "section": section}
+        if text_hash is not None:
+            meta["text_hash"] = text_hash
+        if extra:
+            meta.update(json.loads(extra))
+        return meta
+
+    def get_many(self, rows: List[int]) -> List[Dict]:
+        """Metadata for the given rows, in the order requested"""
+        if not rows:
+            return []
+        unique = list(dict.fromkeys(int(row) for row in rows))
+        placeholders = ','.join('?' * len(unique))
+        records = self._conn().execute(
+            f"SELECT row, id, source, section, text_hash, extra FROM chunks "
+            f"WHERE row IN ({placeholders})",
+            unique
+        ).fetchall()
+        by_row = {record[0]: self._to_dict(record) for record in records}
+        return [by_row[int(row)].copy() for row in rows]
+
+    def all(self) -> List[Dict]:
+        records = self._conn().execute(
+            "SELECT row, id, source, section, text_hash, extra FROM chunks ORDER BY row"
+        ).fetchall()
+        return [self._to_dict(record) for record in records]
+
+    def column(self, field: str) -> List[Any]:
+        """One field for every row, in row order (None where missing); nothing else is loaded"""
+        if field in _COLUMNS:
+            query, params = f"SELECT {field} FROM chunks ORDER BY row", ()
+        else:
+            query, params = "SELECT json_extract(extra, ?) FROM chunks ORDER BY row", (f'$."{field}"',)
+        return [record[0] for record in self._conn().execute(query, params)]
+
+
+def open_metadata_store(index_path: Path):
+    """Prefer the SQLite store, falling back to metadata.json"""
+    db_file = Path(index_path) / METADATA_DB_FILE
+    if db_file.exists():
+        return SQLiteMetadataStore(db_file)
+    return JSONMetadataStore(Path(index_path) / METADATA_JSON_FILE)
@@ -0,0 +1,62 @@
+"""
+Maximal marginal relevance re-ranking over retrieved candidates
+"""
+import os
+from typing import List
+
+import numpy as np
+
+DEFAULT_MMR_LAMBDA = float(os.getenv('RAG_MMR_LAMBDA', '0.7'))
+# Candidates fetched per requested result before MMR selection
+MMR_FETCH_FACTOR = 4
+
+
+def resolve_lambda(mmr_lambda: float = None) -> float:
+    """Per-call lambda, or the RAG_MMR_LAMBDA default"""
+    return DEFAULT_MMR_LAMBDA if mmr_lambda is None else float(mmr_lambda)
+
+
+def mmr_select(candidate_vectors: np.ndarray, relevance: np.ndarray, k: int,
+               mmr_lambda: float = DEFAULT_MMR_LAMBDA) -> List[int]:
+    """
+    Pick k diverse candidates with maximal marginal relevance
+
+    score(i) = lambda * relevance(i) - (1 - lambda) * max_j sim(i, j)
+    over already selected j. Relevance is min-max scaled to [0, 1] so
+    lambda means the same for cosine scores and fused rank scores.
+    Similarities come from one candidate x candidate cosine matrix, and
+    each step updates a running max-similarity vector.
+
+    Returns positions into the candidate arrays, in selection order.
+    lambda = 1 keeps the relevance order.
+    """
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return []
+
+    relevance = np.asarray(relevance, dtype='float64')
+    spread = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones(n)
+    if mmr_lambda >= 1.0:
+        return [int(i) for i in np.argsort(-relevance, kind='stable')[:k]]
+
+    vectors = np.asarray(candidate_vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    similarity = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].astype('float64')
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+
+    while len(selected) < k:
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        scores[~available] = -np.inf
+        choice = int(np.argmax(scores))
+        selected.append(choice)
+        available[choice] = False
+        np.maximum(max_similarity, similarity[choice], out=max_similarity)
+
+    return selected
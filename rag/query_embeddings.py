@@ -0,0 +1,148 @@
+"""
+Precomputed query embeddings for the finite retrieval query space
+"""
+import itertools
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from rag.embedders import Embedder
+from rag.embedding_cache import EmbeddingCache
+
+# Query fragments used by RAGRetriever.build_retrieval_query, in query order
+DIABETES_TYPES = ["T1DM", "T2DM"]
+OPTIONAL_FRAGMENTS = [
+    "HbA1c blood glucose control",
+    "blood pressure hypertension",
+    "cholesterol lipids cardiovascular risk",
+    "hypoglycaemia management",
+    "insulin therapy",
+]
+SCREENING_FRAGMENT = "screening retinopathy kidney foot"
+DEFAULT_QUERY = "diabetes management guidelines"
+
+TABLE_VECTORS_FILE = "query_embeddings.npy"
+TABLE_INDEX_FILE = "query_embeddings.json"
+
+
+def compose_query(diabetes_type: Optional[str], fragments: List[str]) -> str:
+    """Join query fragments exactly as the retriever builds them"""
+    query_parts = []
+    if diabetes_type:
+        query_parts.append(f"{diabetes_type} diabetes")
+    query_parts.extend(fragments)
+    query_parts.append(SCREENING_FRAGMENT)
+    return ' '.join(query_parts) or DEFAULT_QUERY
+
+
+def enumerate_retrieval_queries() -> List[str]:
+    """Every query string build_retrieval_query can produce for valid intakes"""
+    queries = []
+    for diabetes_type in [None] + DIABETES_TYPES:
+        for flags in itertools.product([False, True], repeat=len(OPTIONAL_FRAGMENTS)):
+            fragments = [frag for frag, on in zip(OPTIONAL_FRAGMENTS, flags) if on]
+            queries.append(compose_query(diabetes_type, fragments))
+    return queries
+
+
+def build_query_table(embedder: Embedder, save_path: str, cache: EmbeddingCache = None) -> int:
+    """Embed every enumerable query and store the table next to the index"""
+    queries = enumerate_retrieval_queries()
+    hashes = [EmbeddingCache.text_hash(q) for q in queries]
+
+    cached = cache.get_many(embedder.name, hashes) if cache else {}
+    missing = [q for q, h in zip(queries, hashes) if h not in cached]
+    if missing:
+        fresh = dict(zip((EmbeddingCache.text_hash(q) for q in missing), embedder.embed(missing)))
+        if cache:
+            cache.put_many(embedder.name, fresh)
+        cached.update(fresh)
+
+    vectors = np.vstack([cached[h] for h in hashes]).astype('float32')
+    save_dir = Path(save_path)
+    np.save(save_dir / TABLE_VECTORS_FILE, vectors)
+    with open(save_dir / TABLE_INDEX_FILE, 'w', encoding='utf-8') as f:
+        json.dump({"embedder": embedder.name, "queries": queries}, f, indent=2)
+
+    return len(queries)
+
+
+class QueryEmbeddingCache:
+    """
+    Resolve query embeddings without an API call where possible
+
+    Lookup order: precomputed query table, in-memory LRU, on-disk
+    embedding cache, and only then the embedder itself.
+    """
+
+    def __init__(self, embedder: Embedder, index_path: str, max_entries: int = 1024,
+                 cache_dir: str = None):
+        self.embedder = embedder
+        self.max_entries = max_entries
+        # Snapshots share one disk cache in the index root
+        self.disk_cache = EmbeddingCache(str(Path(cache_dir or index_path) / "embedding_cache.sqlite"))
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.table = self._load_table(Path(index_path))
+
+    def _load_table(self, index_path: Path) -> Dict[str, np.ndarray]:
+        vectors_file = index_path / TABLE_VECTORS_FILE
+        index_file = index_path / TABLE_INDEX_FILE
+        if not vectors_file.exists() or not index_file.exists():
+            return {}
+
+        with open(index_file, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        if info.get("embedder") != self.embedder.name:
+            print(f"Ignoring query table built with {info.get('embedder')}")
+            return {}
+
+        vectors = np.load(vectors_file)
+        return dict(zip(info["queries"], vectors))
+
+    def get(self, text: str) -> np.ndarray:
+        """Return a (1, dim) float32 embedding; callers may modify the copy"""
+        return self.get_many([text])
+
+    def get_many(self, texts: List[str]) -> np.ndarray:
+        """Return an (n, dim) float32 matrix, embedding all misses in one call"""
+        vectors: List[Optional[np.ndarray]] = [self.table.get(text) for text in texts]
+
+        with self._lock:
+            for i, text in enumerate(texts):
+                if vectors[i] is None and text in self._lru:
+                    self._lru.move_to_end(text)
+                    vectors[i] = self._lru[text]
+
+        pending = {}
+        for i, text in enumerate(texts):
+            if vectors[i] is None:
+                pending.setdefault(EmbeddingCache.text_hash(text), []).append(i)
+
+        if pending:
+            found = self.disk_cache.get_many(self.embedder.name, pending.keys())
+            to_embed = [h for h in pending if h not in found]
+            if to_embed:
+                new_vectors = np.asarray(
+                    self.embedder.embed([texts[pending[h][0]] for h in to_embed]),
+                    dtype='float32'
+                )
+                fresh = dict(zip(to_embed, new_vectors))
+                self.disk_cache.put_many(self.embedder.name, fresh)
+                found.update(fresh)
+
+            with self._lock:
+                for text_hash, positions in pending.items():
+                    for i in positions:
+                        vectors[i] = found[text_hash]
+                    self._lru[texts[positions[0]]] = found[text_hash]
+                    self._lru.move_to_end(texts[positions[0]])
+                while len(self._lru) > self.max_entries:
+                    self._lru.popitem(last=False)
+
+        # np.vstack copies, so cached vectors are never modified in place
+        return np.vstack(vectors).astype('float32')
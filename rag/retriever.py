@@ -3,130 +3,313 @@ RAG retriever for diabetes guidelines
 """
 import os
 import json
+import threading
+import time
 import numpy as np
 import faiss
 from typing import List, Dict
 from pathlib import Path
-import openai
-from openai import OpenAI
+from rag.embedders import Embedder, LEGACY_EMBEDDER_NAME, get_embedder
+from rag.filters import FilterCompiler, make_search_params, parse_filters
+from rag.index_factory import apply_search_params, read_index_mmap
+from rag.metadata_store import METADATA_DB_FILE, open_metadata_store
+from rag.mmr import MMR_FETCH_FACTOR, mmr_select, resolve_lambda
+from rag.snapshots import ReadWriteLock, current_version, resolve_snapshot
+from rag.text_store import TextStore
+from rag.query_embeddings import (
+    OPTIONAL_FRAGMENTS, QueryEmbeddingCache, compose_query
+)
 
 class RAGRetriever:
-    """Retrieve relevant guidelines from FAISS index"""
+    """
+    Retrieve relevant guidelines from FAISS index
     
-    def __init__(self, index_path: str = "data/rag", api_key: str = None):
-        self.client = OpenAI(api_key=api_key or os.getenv('OPENAI_API_KEY'))
-        self.embedding_model = "text-embedding-ada-002"
+    The retriever serves the snapshot named by the index's CURRENT file
+    and swaps in a newly published snapshot while running: searches hold
+    the read side of a lock and the swap takes the write side, so
+    in-flight queries finish on the old snapshot.
+    """
+    
+    def __init__(self, index_path: str = "data/rag", api_key: str = None, embedder: Embedder = None,
+                 default_filters: Dict = None, reload_interval: float = None):
+        self.api_key = api_key
+        self.embedder = embedder
         self.index_path = Path(index_path)
         
+        # Deployment-wide metadata filters, e.g. a renal clinic's sources
+        self.default_filters = default_filters or parse_filters(os.getenv('RAG_DEFAULT_FILTERS')) or {}
+        self._filter_compiler = None
+        
+        # Seconds between checks for a newly published snapshot
+        self.reload_interval = (float(os.getenv('RAG_RELOAD_INTERVAL', '5'))
+                                if reload_interval is None else reload_interval)
+        self._lock = ReadWriteLock()
+        self._reload_mutex = threading.Lock()
+        self._next_reload_check = time.monotonic() + self.reload_interval
+        
         # Load index and metadata
         self.index = None
         self.metadata = []
+        self.index_info = {}
+        self.query_cache = None
+        self.text_store = None
+        self.version = None
+        self.snapshot_path = None
         self._load_index()
     
     def _load_index(self):
-        """Load FAISS index and metadata"""
-        index_file = self.index_path / "index.faiss"
-        metadata_file = self.index_path / "metadata.json"
+        """Load the current snapshot (or a legacy flat index) and swap it in"""
+        version, snapshot_path = resolve_snapshot(str(self.index_path))
+        index_file = snapshot_path / "index.faiss"
+        metadata_file = snapshot_path / "metadata.json"
+        metadata_db = snapshot_path / METADATA_DB_FILE
         
-        if not index_file.exists() or not metadata_file.exists():
+        if not index_file.exists() or not (metadata_file.exists() or metadata_db.exists()):
             print("Index not found. Please run index_builder.py first.")
             return
-            
-        self.index = faiss.read_index(str(index_file))
         
-        with open(metadata_file, 'r') as f:
-            self.metadata = json.load(f)
+        # Memory-mapped so worker processes share one copy of the vectors
+        index = read_index_mmap(str(index_file))
+        
+        # Metadata rows are fetched lazily per hit from SQLite when available
+        metadata = open_metadata_store(snapshot_path)
+        
+        # Chunk text is served from a memory-mapped blob, one read per hit
+        # Filter columns are read from the store only when first filtered on
+        filter_compiler = FilterCompiler(metadata)
+        
+        text_store = None
+        if TextStore.exists(str(snapshot_path)):
+            text_store = TextStore(str(snapshot_path))
+        else:
+            print("Chunk text store not found; results will not include text. Rebuild the index.")
+        
+        index_info = self._load_index_info(snapshot_path, index)
+        self._check_embedder(index_info, index, snapshot_path)
+        apply_search_params(index, index_info.get("index_params"))
+        
+        # IVF indexes need a direct map to reconstruct vectors for MMR
+        if index_info.get("index_params", {}).get("type", "").startswith("ivf"):
+            try:
+                faiss.extract_index_ivf(index).make_direct_map()
+            except RuntimeError as e:
+                print(f"Could not build IVF direct map (MMR disabled): {str(e)}")
+        query_cache = QueryEmbeddingCache(self.embedder, str(snapshot_path), cache_dir=str(self.index_path))
+        
+        # Swap everything at once; waits for in-flight searches to finish
+        with self._lock.write():
+            self.index = index
+            self.metadata = metadata
+            self.text_store = text_store
+            self.index_info = index_info
+            self.query_cache = query_cache
+            self.version = version
+            self.snapshot_path = snapshot_path
+            self._filter_compiler = filter_compiler
             
-        print(f"Loaded index with {len(self.metadata)} chunks")
+        print(f"Loaded index {version or '(unversioned)'} with {len(metadata)} chunks")
+    
+    def maybe_reload(self) -> bool:
+        """
+        Swap in a newly published snapshot if there is one
+        
+        CURRENT is checked at most every reload_interval seconds, by one
+        thread at a time. A snapshot that fails to load is reported and
+        the current one keeps serving.
+        """
+        now = time.monotonic()
+        if now < self._next_reload_check or not self._reload_mutex.acquire(blocking=False):
+            return False
+        try:
+            self._next_reload_check = now + self.reload_interval
+            version = current_version(str(self.index_path))
+            if version is None or version == self.version:
+                return False
+            self._load_index()
+            return self.version == version
+        except Exception as e:
+            print(f"Index reload failed, keeping version {self.version}: {str(e)}")
+            return False
+        finally:
+            self._reload_mutex.release()
+    
+    def _load_index_info(self, snapshot_path: Path, index: faiss.Index) -> Dict:
+        """Load build info, treating older indexes as built with ada-002"""
+        info_file = snapshot_path / "index_info.json"
+        if not info_file.exists():
+            return {"embedder": LEGACY_EMBEDDER_NAME, "dimension": index.d}
+        
+        with open(info_file, 'r') as f:
+            return json.load(f)
+    
+    def _check_embedder(self, index_info: Dict, index: faiss.Index, snapshot_path: Path):
+        """Resolve the query embedder and make sure it matches the index"""
+        built_with = index_info.get("embedder", LEGACY_EMBEDDER_NAME)
+        
+        if self.embedder is None:
+            # Follow the index unless a backend is explicitly configured
+            backend = os.getenv('EMBEDDING_BACKEND') or built_with
+            self.embedder = get_embedder(backend, api_key=self.api_key)
+        
+        if self.embedder.name != built_with:
+            raise ValueError(
+                f"Embedder mismatch: index at {snapshot_path} was built with "
+                f"'{built_with}' but queries would use '{self.embedder.name}'. "
+                f"Rebuild the index or set EMBEDDING_BACKEND={built_with}"
+            )
+        if self.embedder.dimension and self.embedder.dimension != index.d:
+            raise ValueError(
+                f"Embedding dimension mismatch: index has {index.d}, "
+                f"embedder '{self.embedder.name}' produces {self.embedder.dimension}"
+            )
     
     def get_embedding(self, text: str) -> np.ndarray:
         """Get embedding for a single text"""
         try:
-            response = self.client.embeddings.create(
-                model=self.embedding_model,
-                input=[text]
-            )
             # Convert to numpy array and ensure float32
-            embedding = np.array([response.data[0].embedding], dtype='float32')
+            embedding = self.query_cache.get(text)
             return embedding
         except Exception as e:
             print(f"Error getting embedding: {str(e)}")
             raise
     
-    def retrieve(self, query: str, k: int = 4) -> List[Dict]:
+    def retrieve(self, query: str, k: int = 4, mmr_lambda: float = None,
+                 filters: Dict = None) -> List[Dict]:
         """
         Retrieve top-k relevant guidelines
         
+        Candidates are over-fetched and re-ranked with maximal marginal
+        relevance; mmr_lambda=1.0 keeps plain similarity order (default
+        from RAG_MMR_LAMBDA).
+        
+        filters restricts the search to matching chunks inside FAISS, e.g.
+        {"source": {"NICE NG28", "NICE NG17"}, "updated": {">=": "2022-01-01"}}
+        (see rag.filters).
+        
         Returns: List of {id, source, section, text}
         """
-        if not self.index:
-            return []
-            
-        try:
-            # Get query embedding
-            query_embedding = self.get_embedding(query)
-            
-            # Ensure query_embedding is 2D and float32
-            if len(query_embedding.shape) == 1:
-                query_embedding = query_embedding.reshape(1, -1)
-            
-            # Normalize for cosine similarity
-            faiss.normalize_L2(query_embedding)
-            
-            # Ensure k doesn't exceed number of vectors in index
-            k = min(k, self.index.ntotal) if self.index.ntotal > 0 else 0
-            if k == 0:
+        self.maybe_reload()
+        with self._lock.read():
+            if not self.index:
                 return []
+                
+            try:
+                return self._search([query], k, mmr_lambda, filters)[0]
+                
+            except Exception as e:
+                print(f"Error in retrieve: {str(e)}")
+                return []
+    
+    def retrieve_many(self, queries: List[str], k: int = 4, mmr_lambda: float = None,
+                      filters: Dict = None) -> List[List[Dict]]:
+        """
+        Retrieve top-k guidelines for several queries at once
+        
+        All queries are embedded in one call and searched with a single
+        batched FAISS search. Returns one result list per query, in order.
+        """
+        self.maybe_reload()
+        with self._lock.read():
+            if not self.index or not queries:
+                return [[] for _ in queries]
             
-            # Search index
-            scores, indices = self.index.search(query_embedding, k)
-            
-            # Format results
-            results = []
-            for score, idx in zip(scores[0], indices[0]):
-                if idx < len(self.metadata):
-                    result = self.metadata[idx].copy()
-                    result['relevance_score'] = float(score)
-                    results.append(result)
-            
-            return results
-            
-        except Exception as e:
-            print(f"Error in retrieve: {str(e)}")
-            return []
+            try:
+                return self._search(queries, k, mmr_lambda, filters)
+                
+            except Exception as e:
+                print(f"Error in retrieve_many: {str(e)}")
+                return [[] for _ in queries]
+    
+    def _search(self, queries: List[str], k: int, mmr_lambda: float = None,
+                filters: Dict = None) -> List[List[Dict]]:
+        """Embed queries, search the index, apply MMR and format hits per query (read lock held)"""
+        mmr_lambda = resolve_lambda(mmr_lambda)
+        fetch_k = k * MMR_FETCH_FACTOR if mmr_lambda < 1.0 else k
+        
+        # Ensure k doesn't exceed number of vectors in index
+        searchable = self.index.ntotal
+        search_params, keepalive = None, None
+        filters = {**self.default_filters, **(filters or {})}
+        if filters:
+            mask = self._compile_filters(filters)
+            searchable = int(mask.sum())
+            search_params, keepalive = make_search_params(mask, self.index_info.get("index_params"))
+        
+        fetch_k = min(fetch_k, searchable) if searchable > 0 else 0
+        if fetch_k == 0:
+            return [[] for _ in queries]
+        
+        # Query matrix is (n, dim) float32
+        query_embeddings = self.query_cache.get_many(list(queries))
+        
+        # Normalize for cosine similarity
+        faiss.normalize_L2(query_embeddings)
+        
+        # Search index (filtered inside FAISS via an IDSelector bitmap)
+        if search_params is not None:
+            scores, indices = self.index.search(query_embeddings, fetch_k, params=search_params)
+        else:
+            scores, indices = self.index.search(query_embeddings, fetch_k)
+        
+        # Format results
+        all_results = []
+        for row_scores, row_indices in zip(scores, indices):
+            hits = [(float(score), int(idx)) for score, idx in zip(row_scores, row_indices)
+                    if 0 <= idx < len(self.metadata)]
+            if len(hits) > k:
+                hits = self._mmr_rerank(hits, k, mmr_lambda)
+            results = self.metadata.get_many([idx for _, idx in hits])
+            for result, (score, idx) in zip(results, hits):
+                if self.text_store is not None:
+                    result['text'] = self.text_store.get(idx)
+                result['relevance_score'] = score
+            all_results.append(results)
+        
+        return all_results
+    
+    def _compile_filters(self, filters: Dict) -> np.ndarray:
+        """Row mask for the filters; each filtered column is read once per snapshot"""
+        return self._filter_compiler.compile(filters)
+    
+    def _mmr_rerank(self, hits: List, k: int, mmr_lambda: float) -> List:
+        """Diverse top-k of (score, row) hits using the stored index vectors"""
+        try:
+            vectors = np.vstack([self.index.reconstruct(idx) for _, idx in hits])
+        except RuntimeError as e:
+            # Index type without reconstruction support: keep similarity order
+            print(f"MMR skipped: {str(e)}")
+            return hits[:k]
+        
+        relevance = np.array([score for score, _ in hits])
+        return [hits[i] for i in mmr_select(vectors, relevance, k, mmr_lambda)]
     
     def build_retrieval_query(self, patient_data: Dict) -> str:
         """Build retrieval query from patient context"""
-        query_parts = []
-        
-        # Add diabetes type
-        if patient_data.get('diabetes_type'):
-            query_parts.append(f"{patient_data['diabetes_type']} diabetes")
+        hba1c_frag, bp_frag, lipids_frag, hypo_frag, insulin_frag = OPTIONAL_FRAGMENTS
+        fragments = []
         
         # Add key clinical areas based on data
         labs = patient_data.get('labs', {})
         if labs.get('hba1c_pct'):
-            query_parts.append("HbA1c blood glucose control")
+            fragments.append(hba1c_frag)
         
         if patient_data.get('bp_sys'):
-            query_parts.append("blood pressure hypertension")
+            fragments.append(bp_frag)
             
         if labs.get('lipids'):
-            query_parts.append("cholesterol lipids cardiovascular risk")
+            fragments.append(lipids_frag)
         
-        if patient_data.get('hypos_90d', 0) > 0:
-            query_parts.append("hypoglycaemia management")
+        if (patient_data.get('hypos_90d') or 0) > 0:
+            fragments.append(hypo_frag)
             
         # Add medications context
         meds = patient_data.get('meds', [])
         if any('insulin' in med.get('name', '').lower() for med in meds):
-            query_parts.append("insulin therapy")
-        
-        # Add screening needs
-        query_parts.append("screening retinopathy kidney foot")
+            fragments.append(insulin_frag)
         
-        query = ' '.join(query_parts)
-        return query or "diabetes management guidelines"
+        # Diabetes type leads and screening needs close every query, so the
+        # result is always one of enumerate_retrieval_queries()
+        return compose_query(patient_data.get('diabetes_type'), fragments)
 
 if __name__ == "__main__":
     retriever = RAGRetriever()
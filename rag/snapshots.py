@@ -0,0 +1,135 @@
+"""
+Immutable versioned index snapshots published through a CURRENT file
+
+Each build writes a complete index (FAISS, metadata, text, query table)
+into a staging directory, which is renamed into snapshots/<version>/.
+CURRENT is then replaced atomically, so a reader always sees one whole
+snapshot. Directories without CURRENT are read as a legacy flat index.
+"""
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional, Tuple
+
+SNAPSHOTS_DIR = "snapshots"
+CURRENT_FILE = "CURRENT"
+# Published snapshots kept besides the current one, for in-flight readers
+DEFAULT_KEEP = int(os.getenv('RAG_SNAPSHOT_KEEP', '3'))
+
+
+def begin_snapshot(index_root: str) -> Path:
+    """Create an empty staging directory for a new snapshot"""
+    staging = Path(index_root) / SNAPSHOTS_DIR / f".staging-{uuid.uuid4().hex}"
+    staging.mkdir(parents=True)
+    return staging
+
+
+def abort_snapshot(staging: Path):
+    """Remove a staging directory after a failed build"""
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def publish_snapshot(index_root: str, staging: Path, keep: int = DEFAULT_KEEP) -> str:
+    """Move a finished staging directory into place and make it current"""
+    root = Path(index_root)
+    version = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    os.replace(staging, root / SNAPSHOTS_DIR / version)
+
+    tmp_current = root / f"{CURRENT_FILE}.{uuid.uuid4().hex}.tmp"
+    tmp_current.write_text(version, encoding='utf-8')
+    os.replace(tmp_current, root / CURRENT_FILE)
+
+    prune_snapshots(index_root, keep)
+    return version
+
+
+def current_version(index_root: str) -> Optional[str]:
+    """Published version name, or None for a legacy flat index"""
+    current_file = Path(index_root) / CURRENT_FILE
+    try:
+        return current_file.read_text(encoding='utf-8').strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve_snapshot(index_root: str) -> Tuple[Optional[str], Path]:
+    """(version, directory) of the index to load"""
+    version = current_version(index_root)
+    if version is None:
+        return None, Path(index_root)
+    return version, Path(index_root) / SNAPSHOTS_DIR / version
+
+
+def prune_snapshots(index_root: str, keep: int = DEFAULT_KEEP):
+    """Delete all but the current and the `keep` newest older snapshots"""
+    snapshots_dir = Path(index_root) / SNAPSHOTS_DIR
+    current = current_version(index_root)
+    versions = sorted(
+        (path for path in snapshots_dir.iterdir()
+         if path.is_dir() and not path.name.startswith(".") and path.name != current),
+        key=lambda path: path.stat().st_mtime, reverse=True
+    )
+    for path in versions[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class ReadWriteLock:
+    """
+    Many concurrent readers or one writer; a waiting writer blocks new readers
+
+    Searches hold the read side, so a snapshot swap waits for in-flight
+    queries to finish and is never starved by a steady stream of them.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    def read(self):
+        return _Held(self.acquire_read, self.release_read)
+
+    def write(self):
+        return _Held(self.acquire_write, self.release_write)
+
+
+class _Held:
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._release()
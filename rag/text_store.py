@@ -0,0 +1,89 @@
+"""
+Memory-mapped chunk text store: length-prefixed UTF-8 blob plus offsets
+"""
+import mmap
+import struct
+from pathlib import Path
+from typing import Iterable, List
+
+import numpy as np
+
+TEXT_BLOB_FILE = "chunks.bin"
+TEXT_OFFSETS_FILE = "chunks.offsets.npy"
+
+_LENGTH = struct.Struct("<I")
+
+
+class TextStoreWriter:
+    """Append chunk texts in FAISS row order; usable with streamed chunks"""
+
+    def __init__(self, save_path: str):
+        self.save_dir = Path(save_path)
+        self.save_dir.mkdir(parents=True, exist_ok=True)
+        self._blob = open(self.save_dir / f"{TEXT_BLOB_FILE}.tmp", 'wb')
+        self._offsets: List[int] = []
+        self._position = 0
+
+    def add(self, text: str) -> int:
+        """Append one chunk and return its row number"""
+        data = text.encode('utf-8')
+        self._offsets.append(self._position)
+        self._blob.write(_LENGTH.pack(len(data)))
+        self._blob.write(data)
+        self._position += _LENGTH.size + len(data)
+        return len(self._offsets) - 1
+
+    def add_many(self, texts: Iterable[str]):
+        for text in texts:
+            self.add(text)
+
+    def close(self):
+        """Finish the blob and publish both files"""
+        self._blob.close()
+        np.save(self.save_dir / f"{TEXT_OFFSETS_FILE}.tmp.npy",
+                np.asarray(self._offsets, dtype='uint64'))
+        Path(self.save_dir / f"{TEXT_BLOB_FILE}.tmp").replace(self.save_dir / TEXT_BLOB_FILE)
+        Path(self.save_dir / f"{TEXT_OFFSETS_FILE}.tmp.npy").replace(self.save_dir / TEXT_OFFSETS_FILE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._blob.close()
+
+
+def write_text_store(texts: Iterable[str], save_path: str):
+    """Write all chunk texts in one go"""
+    with TextStoreWriter(save_path) as writer:
+        writer.add_many(texts)
+
+
+class TextStore:
+    """O(1) read-only access to chunk text by row, without loading the corpus"""
+
+    def __init__(self, index_path: str):
+        index_dir = Path(index_path)
+        self._offsets = np.load(index_dir / TEXT_OFFSETS_FILE, mmap_mode='r')
+        self._file = open(index_dir / TEXT_BLOB_FILE, 'rb')
+        size = (index_dir / TEXT_BLOB_FILE).stat().st_size
+        self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    @staticmethod
+    def exists(index_path: str) -> bool:
+        index_dir = Path(index_path)
+        return (index_dir / TEXT_BLOB_FILE).exists() and (index_dir / TEXT_OFFSETS_FILE).exists()
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def get(self, row: int) -> str:
+        offset = int(self._offsets[row])
+        (length,) = _LENGTH.unpack_from(self._blob, offset)
+        start = offset + _LENGTH.size
+        return bytes(self._blob[start:start + length]).decode('utf-8')
+
+    def get_many(self, rows: Iterable[int]) -> List[str]:
+        return [self.get(row) for row in rows]
@@ -0,0 +1,183 @@
+"""
+Report sections computed deterministically from the rules and patient intake
+
+labs_table, snapshot and screening_tracker depend only on thresholds in
+rules.json and the intake, so they are built here instead of by the LLM.
+"""
+import calendar
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from rules import get_traffic_light_status
+
+PRECOMPUTED_SECTIONS = ("labs_table", "snapshot", "screening_tracker")
+
+SCREENING_DOMAINS = {
+    "retina": "Retinal screening",
+    "foot": "Foot check",
+    "renal": "Kidney function (eGFR/ACR)",
+    "flu": "Flu vaccination",
+    "pneumo": "Pneumococcal vaccination",
+}
+# Screening is flagged 'due soon' this many days before its due date
+DUE_SOON_DAYS = 30
+
+_STATUS_RANK = {"green": 0, "amber": 1, "red": 2}
+
+
+def _first(values: Dict, *keys: str) -> Optional[float]:
+    """First present value among alias keys (intake and PDF extraction differ)"""
+    for key in keys:
+        if values.get(key) is not None:
+            return values[key]
+    return None
+
+
+def _lab_row(test: str, value: Any, unit: str, target: str, status: str, comment: str) -> Dict:
+    return {
+        "test": test,
+        "value": f"{value} {unit}".strip(),
+        "target": target,
+        "status": status,
+        "comment": comment,
+    }
+
+
+def build_labs_table(patient: Dict, rules: Dict) -> List[Dict]:
+    """One row per available lab, with rule-based targets and status"""
+    labs = patient.get('labs') or {}
+    lipids = labs.get('lipids') or {}
+    traffic = rules.get('traffic', {})
+    rows = []
+
+    hba1c = _first(labs, 'hba1c_pct')
+    if hba1c is not None:
+        target = traffic.get('hbA1c', {}).get('green_max', rules.get('hba1c_t1dm_target_pct'))
+        status = get_traffic_light_status('hbA1c', hba1c, rules)
+        comment = "At target" if status == 'green' else "Above target; review glycaemic management"
+        rows.append(_lab_row("HbA1c", hba1c, "%", f"≤ {target}%", status, comment))
+
+    for test, keys, unit in (("Fasting plasma glucose", ('fpg_mmol',), "mmol/L"),
+                             ("2h post-prandial glucose", ('ppg2h_mmol',), "mmol/L"),
+                             ("Creatinine", ('creatinine_umol', 'creat'), "µmol/L")):
+        value = _first(labs, *keys)
+        if value is not None:
+            rows.append(_lab_row(test, value, unit, "—", "info", "Interpret alongside HbA1c and eGFR"))
+
+    egfr = _first(labs, 'egfr', 'eGFR')
+    if egfr is not None:
+        threshold = rules.get('egfr_ok', 60)
+        ok = egfr >= threshold
+        rows.append(_lab_row("eGFR", egfr, "mL/min/1.73m²", f"≥ {threshold}", 'green' if ok else 'amber',
+                             "Kidney function preserved" if ok else "Reduced kidney function; review renal risk"))
+
+    acr = _first(labs, 'acr_mgmmol', 'acr')
+    if acr is not None:
+        threshold = rules.get('acr_albuminuria', 3.0)
+        ok = acr < threshold
+        rows.append(_lab_row("Urine ACR", acr, "mg/mmol", f"< {threshold}", 'green' if ok else 'amber',
+                             "No albuminuria" if ok else "Albuminuria; consider ACE inhibitor/ARB"))
+
+    ldl = lipids.get('ldl')
+    if ldl is not None:
+        target = traffic.get('ldl', {}).get('green_max', rules.get('ldl_high_risk_target'))
+        status = get_traffic_light_status('ldl', ldl, rules)
+        comment = "At target" if status == 'green' else "Above target; review lipid management"
+        rows.append(_lab_row("LDL cholesterol", ldl, "mmol/L", f"≤ {target}", status, comment))
+
+    for test, key in (("Total cholesterol", 'tc'), ("HDL cholesterol", 'hdl'), ("Triglycerides", 'tg')):
+        if lipids.get(key) is not None:
+            rows.append(_lab_row(test, lipids[key], "mmol/L", "—", "info", "Part of lipid profile"))
+
+    return rows
+
+
+def _bmi(patient: Dict) -> Optional[float]:
+    weight, height = patient.get('weight_kg'), patient.get('height_cm')
+    if not weight or not height:
+        return None
+    return round(weight / (height / 100) ** 2, 1)
+
+
+def build_snapshot(patient: Dict, rules: Dict) -> Dict:
+    """Traffic-light status per key metric, overall risk level and priority actions"""
+    labs = patient.get('labs') or {}
+    hba1c = labs.get('hba1c_pct')
+    bp_sys = patient.get('bp_sys')
+    bmi = _bmi(patient)
+    ldl = (labs.get('lipids') or {}).get('ldl')
+
+    statuses = {}
+    actions = []
+    metrics = (
+        ("hba1c_status", 'hbA1c', hba1c, "Intensify glycaemic management (HbA1c {value}%)"),
+        ("bp_status", 'bp_sys', bp_sys, "Review blood pressure control ({value} mmHg systolic)"),
+        ("bmi_status", 'bmi', bmi, "Support weight management (BMI {value} kg/m²)"),
+        ("ldl_status", 'ldl', ldl, "Review lipid-lowering therapy (LDL {value} mmol/L)"),
+    )
+    for field, metric, value, action in metrics:
+        if value is None:
+            statuses[field] = "not recorded"
+            continue
+        status = get_traffic_light_status(metric, value, rules)
+        statuses[field] = status
+        if status != 'green':
+            actions.append((_STATUS_RANK[status], action.format(value=value)))
+
+    worst = max((_STATUS_RANK[s] for s in statuses.values() if s in _STATUS_RANK), default=0)
+    return {
+        **statuses,
+        "risk_level": ("low", "moderate", "high")[worst],
+        "priority_actions": [text for _, text in sorted(actions, key=lambda item: -item[0])],
+    }
+
+
+def _add_months(day: date, months: int) -> date:
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def build_screening_tracker(patient: Dict, rules: Dict, today: date = None) -> List[Dict]:
+    """Last date, next due date and status for each screening interval in the rules"""
+    today = today or date.today()
+    screenings = patient.get('screenings') or {}
+    rows = []
+
+    for domain, interval_months in rules.get('screening_intervals', {}).items():
+        last = screenings.get(f"{domain}_date")
+        try:
+            last_date = date.fromisoformat(str(last)) if last else None
+        except ValueError:
+            last_date = None
+
+        if last_date is None:
+            next_due, status = today.isoformat(), "not recorded"
+        else:
+            due = _add_months(last_date, interval_months)
+            next_due = due.isoformat()
+            if due < today:
+                status = "overdue"
+            elif (due - today).days <= DUE_SOON_DAYS:
+                status = "due soon"
+            else:
+                status = "up to date"
+
+        rows.append({
+            "domain": SCREENING_DOMAINS.get(domain, domain.title()),
+            "last_date": last_date.isoformat() if last_date else None,
+            "result": screenings.get(f"{domain}_result"),
+            "next_due": next_due,
+            "status": status,
+        })
+
+    return rows
+
+
+def precompute_sections(patient: Dict, rules: Dict, today: date = None) -> Dict[str, Any]:
+    """All rule-derived report sections for the intake"""
+    return {
+        "labs_table": build_labs_table(patient, rules),
+        "snapshot": build_snapshot(patient, rules),
+        "screening_tracker": build_screening_tracker(patient, rules, today),
+    }
@@ -3,131 +3,174 @@ RAG Retrieval Pipeline for Diabetes Report Generator
 Implements hybrid retrieval with UK clinical guidelines
 """
 
+import heapq
 import os
+import re
+from collections import Counter
 from typing import List, Dict, Any, Optional
 import json
 from datetime import datetime
+import numpy as np
 import streamlit as st
 
+from rag.bm25 import reciprocal_rank_fusion, tokenize
+from rag.corpus import get_corpus
+from rag.mmr import MMR_FETCH_FACTOR, mmr_select, resolve_lambda
+from rag.snapshots import ReadWriteLock
+
+# Reciprocal rank fusion constant (rank offset)
+RRF_K = 60
+MAX_CACHED_QUERY_VECTORS = 1024
+
+class KeywordIndex:
+    """
+    Compiled keyword scorer for the knowledge base
+    
+    Reproduces the substring term matching of the original scorer: a
+    query term matches a chunk when it occurs anywhere in the lowercased
+    content. Query terms never contain whitespace, so that is the same as
+    the term occurring inside one of the chunk's whitespace tokens. The
+    token vocabulary and posting lists are built once, and each distinct
+    query term's match mask is computed once and cached.
+    """
+    
+    MAX_CACHED_TERMS = 4096
+    
+    def __init__(self, knowledge_base: List[Dict]):
+        self.num_docs = len(knowledge_base)
+        
+        postings: Dict[str, set] = {}
+        for doc_id, chunk in enumerate(knowledge_base):
+            for token in chunk['content'].lower().split():
+                postings.setdefault(token, set()).add(doc_id)
+        self.postings = {token: np.fromiter(sorted(ids), dtype='int64') for token, ids in postings.items()}
+        
+        # Static boosts: recent sources +0.5, NICE NG28 +1
+        self.boosts = np.array([
+            (0.5 if chunk['updated'] > '2022-01-01' else 0.0) +
+            (1.0 if chunk['source'] == 'NICE NG28' else 0.0)
+            for chunk in knowledge_base
+        ])
+        self.intensify_mask = self.term_mask('intensif')
+        self._term_masks: Dict[str, np.ndarray] = {}
+    
+    def term_mask(self, term: str) -> np.ndarray:
+        """Boolean mask of chunks whose content contains the term"""
+        mask = np.zeros(self.num_docs, dtype=bool)
+        for token, doc_ids in self.postings.items():
+            if term in token:
+                mask[doc_ids] = True
+        return mask
+    
+    def _cached_mask(self, term: str) -> np.ndarray:
+        mask = self._term_masks.get(term)
+        if mask is None:
+            if len(self._term_masks) >= self.MAX_CACHED_TERMS:
+                self._term_masks.clear()
+            mask = self.term_mask(term)
+            self._term_masks[term] = mask
+        return mask
+    
+    def scores(self, query: str, intensify_boost: bool = False) -> np.ndarray:
+        """Score every chunk: one point per matching query term plus boosts"""
+        term_counts = Counter(query.lower().split())
+        scores = self.boosts.copy()
+        if term_counts:
+            masks = np.vstack([self._cached_mask(term) for term in term_counts])
+            counts = np.fromiter(term_counts.values(), dtype='float64', count=len(term_counts))
+            scores += counts @ masks
+        if intensify_boost:
+            scores += 2.0 * self.intensify_mask
+        return scores
+    
+    def top_k(self, query: str, k: int, intensify_boost: bool = False) -> List[int]:
+        """
+        Indices of the k best chunks with a positive score
+        
+        heapq.nlargest is equivalent to a stable descending sort, so ties
+        keep knowledge-base order exactly as before.
+        """
+        scores = self.scores(query, intensify_boost)
+        candidates = np.flatnonzero(scores > 0).tolist()
+        return heapq.nlargest(k, candidates, key=scores.__getitem__)
+
+
 class RAGPipeline:
     """Retrieval-Augmented Generation pipeline for UK diabetes guidelines"""
     
-    def __init__(self):
-        """Initialize RAG pipeline with mock knowledge base"""
+    def __init__(self, retrieval_mode: str = None, embedder=None):
+        """
+        Initialize RAG pipeline over the shared guideline corpus
+        
+        Args:
+            retrieval_mode: 'hybrid' (BM25, plus dense when the corpus
+                was compiled with vectors, with reciprocal rank fusion) or
+                'keyword' (term matching); defaults to the
+                RAG_PIPELINE_MODE setting, then 'hybrid'
+            embedder: Query embedder for the dense leg; defaults to the
+                embedder the corpus vectors were compiled with
+        """
         
-        # In production, this would connect to ChromaDB with real embeddings
-        # For POC, using mock data representing UK guidelines
+        self.retrieval_mode = retrieval_mode or os.getenv('RAG_PIPELINE_MODE', 'hybrid')
+        self._configured_embedder = embedder
+        # Retrievals hold the read side; switching corpus versions the write side
+        self._lock = ReadWriteLock()
         
-        self.knowledge_base = self._load_mock_knowledge_base()
-        self.sources_metadata = self._load_sources_metadata()
+        # Guideline chunks come from the compiled corpus shared by every
+        # pipeline and retriever in the process
+        self.corpus = None
+        self._sync_corpus()
     
-    def _load_mock_knowledge_base(self) -> List[Dict]:
-        """Load mock UK diabetes guidelines knowledge base"""
+    def _sync_corpus(self):
+        """
+        Switch to the published corpus version if it changed
         
-        return [
-            {
-                "id": "nice_ng28_001",
-                "content": "For adults with type 2 diabetes, agree an individualised HbA1c target. For adults on a drug associated with hypoglycaemia, support them to aim for an HbA1c level of 53 mmol/mol (7.0%).",
-                "source": "NICE NG28",
-                "title": "Type 2 diabetes in adults: management",
-                "url": "https://www.nice.org.uk/guidance/ng28",
-                "updated": "2022-03-31",
-                "section": "Blood glucose management"
-            },
-            {
-                "id": "nice_ng28_002",
-                "content": "Advise adults with type 2 diabetes that lifestyle changes (losing weight if overweight, eating healthily, taking regular exercise) can improve blood glucose control and reduce cardiovascular risk.",
-                "source": "NICE NG28",
-                "title": "Type 2 diabetes in adults: management",
-                "url": "https://www.nice.org.uk/guidance/ng28",
-                "updated": "2022-03-31",
-                "section": "Lifestyle management"
-            },
-            {
-                "id": "nhs_diet_001",
-                "content": "Follow the NHS Eatwell Guide. Aim to eat: plenty of fruit and vegetables - at least 5 portions a day; starchy foods like potatoes, bread, rice or pasta - choose wholegrain varieties; some dairy or dairy alternatives; beans, pulses, fish, eggs, meat and other proteins.",
-                "source": "NHS",
-                "title": "Healthy eating for type 2 diabetes",
-                "url": "https://www.nhs.uk/conditions/type-2-diabetes/food-and-keeping-active/",
-                "updated": "2023-06-15",
-                "section": "Diet advice"
-            },
-            {
-                "id": "nhs_activity_001",
-                "content": "Adults should aim to do at least 150 minutes of moderate intensity activity a week or 75 minutes of vigorous intensity activity a week. Spread exercise evenly over 4 to 5 days a week, or every day.",
-                "source": "NHS",
-                "title": "Physical activity guidelines",
-                "url": "https://www.nhs.uk/live-well/exercise/",
-                "updated": "2023-04-20",
-                "section": "Exercise recommendations"
-            },
-            {
-                "id": "diabetes_uk_001",
-                "content": "Self-monitoring of blood glucose is recommended for people with type 2 diabetes who are on insulin or medications that can cause hypoglycaemia. Test before meals and 2 hours after to see how food affects your levels.",
-                "source": "Diabetes UK",
-                "title": "Blood glucose monitoring",
-                "url": "https://www.diabetes.org.uk/guide-to-diabetes/managing-your-diabetes/testing",
-                "updated": "2023-07-10",
-                "section": "Monitoring"
-            },
-            {
-                "id": "bda_001",
-                "content": "Use the plate method for portion control: fill half your plate with non-starchy vegetables, one quarter with lean protein, and one quarter with carbohydrate foods. Choose foods with a low glycaemic index where possible.",
-                "source": "BDA",
-                "title": "Food Fact Sheet - Diabetes",
-                "url": "https://www.bda.uk.com/resource/diabetes.html",
-                "updated": "2023-05-01",
-                "section": "Portion control"
-            },
-            {
-                "id": "nice_ng28_003",
-                "content": "For adults with type 2 diabetes, if HbA1c levels are not adequately controlled by a single drug and rise to 58 mmol/mol (7.5%) or higher, reinforce advice about diet, lifestyle and adherence to drug treatment, and intensify drug treatment.",
-                "source": "NICE NG28",
-                "title": "Type 2 diabetes in adults: management",
-                "url": "https://www.nice.org.uk/guidance/ng28",
-                "updated": "2022-03-31",
-                "section": "Treatment escalation"
-            },
+        Pipelines live for the whole app session (st.cache_resource), so
+        the registry is consulted on every retrieval; a newly published
+        corpus reaches running apps on their next query.
+        """
+        corpus = get_corpus()
+        if corpus is self.corpus:
+            return
+        with self._lock.write():
+            if corpus is self.corpus:
+                return
+            self.corpus = corpus
+            self.knowledge_base = self._load_mock_knowledge_base()
+            self.sources_metadata = self._load_sources_metadata()
+            
+            # BM25 postings are precomputed in the corpus; the keyword index
+            # is built once per corpus version; dense vectors on first use
+            self.bm25 = corpus.bm25
+            self.keyword_index = corpus.derived(
+                'keyword_index', lambda: KeywordIndex(self.knowledge_base)
+            )
+            self.embedder = self._configured_embedder
+            self._dense_vectors = None
+            self._dense_available = True
+            self._query_vectors: Dict[str, np.ndarray] = {}
+            self._hashed_vectors = None
+            self._chunk_positions = {chunk['id']: i for i, chunk in enumerate(self.knowledge_base)}
+    
+    def _load_mock_knowledge_base(self) -> List[Dict]:
+        """Knowledge base view of the shared guideline corpus"""
+        return self.corpus.derived('pipeline_knowledge_base', lambda: [
             {
-                "id": "nhs_sick_day_001",
-                "content": "During illness: continue taking diabetes medications, check blood glucose more frequently (every 2-4 hours), drink plenty of fluids, try to eat normally. Seek urgent medical advice if blood glucose stays high (over 15 mmol/L) or you have ketones.",
-                "source": "NHS",
-                "title": "Sick day rules for diabetes",
-                "url": "https://www.nhs.uk/conditions/type-2-diabetes/",
-                "updated": "2023-06-01",
-                "section": "Sick day management"
+                "id": doc["id"],
+                "content": doc["text"],
+                "source": doc["source"],
+                "title": doc.get("title", doc["section"]),
+                "url": doc.get("url", ""),
+                "updated": doc.get("updated", ""),
+                "section": doc["section"],
+                "tokens": doc.get("tokens")
             }
-        ]
+            for doc in self.corpus.documents
+        ])
     
     def _load_sources_metadata(self) -> Dict:
         """Load metadata for all knowledge sources"""
-        
-        return {
-            "NICE NG28": {
-                "full_name": "NICE Guideline NG28 - Type 2 diabetes in adults: management",
-                "authority": "National Institute for Health and Care Excellence",
-                "last_updated": "March 2022",
-                "scope": "Adults with type 2 diabetes"
-            },
-            "NHS": {
-                "full_name": "NHS Diabetes Guidance",
-                "authority": "National Health Service",
-                "last_updated": "2023",
-                "scope": "General population and diabetes patients"
-            },
-            "Diabetes UK": {
-                "full_name": "Diabetes UK Clinical Guidance",
-                "authority": "Diabetes UK Charity",
-                "last_updated": "2023",
-                "scope": "People living with diabetes"
-            },
-            "BDA": {
-                "full_name": "British Dietetic Association Food Facts",
-                "authority": "British Dietetic Association",
-                "last_updated": "2023",
-                "scope": "Dietary management for diabetes"
-            }
-        }
+        return self.corpus.sources
     
     def build_retrieval_query(
         self,
@@ -194,57 +237,159 @@ class RAGPipeline:
         self,
         query: str,
         patient_context: Dict,
-        top_k: int = 6
+        top_k: int = 6,
+        mmr_lambda: float = None
     ) -> tuple[List[Dict], Dict[str, Dict]]:
         """
         Retrieve relevant sources using hybrid search
         
+        In hybrid mode, a precomputed inverted BM25 index and dense
+        embeddings each rank the chunks and reciprocal rank fusion merges
+        them. Keyword mode keeps the original term-matching scorer.
+        Either way, candidates are over-fetched and re-ranked with
+        maximal marginal relevance (mmr_lambda=1.0 disables it).
+        
         Returns:
             - List of retrieved chunks with content
             - Dictionary mapping S# to source metadata
         """
         
-        # In production, this would use:
-        # 1. Dense retrieval with embeddings
-        # 2. BM25 sparse retrieval
-        # 3. Cross-encoder reranking
-        # 4. MMR diversity filtering
-        
-        # For POC, using simple keyword matching and scoring
-        scored_chunks = []
+        self._sync_corpus()
+        mmr_lambda = resolve_lambda(mmr_lambda)
+        fetch_k = top_k * MMR_FETCH_FACTOR if mmr_lambda < 1.0 else top_k
         
-        query_terms = query.lower().split()
-        
-        for chunk in self.knowledge_base:
-            score = 0
-            content_lower = chunk['content'].lower()
-            
-            # Score based on query term matches
-            for term in query_terms:
-                if term in content_lower:
-                    score += 1
-            
-            # Boost recent sources
-            if chunk['updated'] > '2022-01-01':
-                score += 0.5
-            
-            # Boost NICE guidelines
-            if chunk['source'] == 'NICE NG28':
-                score += 1
-            
-            # Context-specific boosting
-            hba1c = patient_context.get('labs_data', {}).get('hba1c')
-            if hba1c and hba1c >= 8 and 'intensif' in content_lower:
-                score += 2
+        with self._lock.read():
+            if self.retrieval_mode == 'keyword':
+                candidates = self._keyword_retrieve(query, patient_context, fetch_k)
+            else:
+                candidates = self._hybrid_retrieve(query, patient_context, fetch_k)
             
-            if score > 0:
-                scored_chunks.append((score, chunk))
-        
-        # Sort by score and take top K
-        scored_chunks.sort(key=lambda x: x[0], reverse=True)
-        top_chunks = [chunk for _, chunk in scored_chunks[:top_k]]
+            top_chunks = [candidates[i] for i in self._mmr_rerank(candidates, top_k, mmr_lambda)]
+        return top_chunks, self._build_sources_map(top_chunks)
+    
+    def _keyword_retrieve(self, query: str, patient_context: Dict, top_k: int) -> List[Dict]:
+        """Keyword matching with source and recency boosts"""
+        # Context-specific boosting
+        hba1c = patient_context.get('labs_data', {}).get('hba1c')
+        intensify_boost = bool(hba1c and hba1c >= 8)
+        
+        top_ids = self.keyword_index.top_k(query, top_k, intensify_boost)
+        return [self.knowledge_base[doc_id] for doc_id in top_ids]
+    
+    def _mmr_rerank(self, candidates: List[Dict], top_k: int, mmr_lambda: float) -> List[int]:
+        """Positions of a diverse top-k among rank-ordered candidates"""
+        if len(candidates) <= top_k:
+            return list(range(len(candidates)))
+        
+        # First-stage order is the relevance signal (reciprocal rank)
+        relevance = 1.0 / np.arange(1, len(candidates) + 1)
+        vectors = self._similarity_vectors()[[self._chunk_positions[c['id']] for c in candidates]]
+        return mmr_select(vectors, relevance, top_k, mmr_lambda)
+    
+    def _similarity_vectors(self) -> np.ndarray:
+        """Dense chunk vectors if already built, else hashed term vectors"""
+        if self._dense_vectors is not None:
+            return self._dense_vectors
+        if self._hashed_vectors is None:
+            from rag.embedders import HashingEmbedder
+            self._hashed_vectors = self.corpus.derived('hashed_vectors', lambda: HashingEmbedder().embed(
+                [chunk['content'] for chunk in self.knowledge_base]
+            ))
+        return self._hashed_vectors
+    
+    def _hybrid_retrieve(self, query: str, patient_context: Dict, top_k: int) -> List[Dict]:
+        """BM25 and dense rankings fused with reciprocal rank fusion, plus source boosts"""
+        candidates = max(top_k * 3, 10)
+        rankings = [[doc_id for doc_id, _ in self.bm25.search(query, candidates)]]
+        
+        # Short queries with numbers or units ("ACR 3 mg/mmol") are lexical;
+        # BM25 answers them exactly without an embedding call
+        if not self._is_lexical_query(query):
+            dense_ranking = self._dense_search(query, candidates)
+            if dense_ranking:
+                rankings.append(dense_ranking)
+        
+        # Patient context contributes its own ranking
+        hba1c = patient_context.get('labs_data', {}).get('hba1c')
+        if hba1c and hba1c >= 8:
+            rankings.append(np.flatnonzero(self.keyword_index.intensify_mask).tolist())
+        
+        # Recency and NICE NG28 boosts, as in keyword mode: a boost of 1.0
+        # is worth a first place in one ranking
+        fused = dict(reciprocal_rank_fusion(rankings, k=RRF_K))
+        for doc_id in fused:
+            fused[doc_id] += self.keyword_index.boosts[doc_id] / (RRF_K + 1)
+        ranked = sorted(fused, key=fused.__getitem__, reverse=True)
+        return [self.knowledge_base[doc_id] for doc_id in ranked[:top_k]]
+    
+    @staticmethod
+    def _is_lexical_query(query: str) -> bool:
+        """Heuristic: few tokens including a number or a slash-separated unit"""
+        tokens = tokenize(query)
+        return len(tokens) <= 6 and bool(re.search(r"\d|/", query))
+    
+    def _dense_search(self, query: str, k: int) -> List[int]:
+        """Rank chunks by cosine similarity; empty without compiled corpus vectors"""
+        if not self._ensure_dense_vectors():
+            return []
+        query_vec = self._query_vectors.get(query)
+        if query_vec is None:
+            try:
+                query_vec = np.asarray(self.embedder.embed_query(query), dtype='float32')[0]
+            except Exception as e:
+                print(f"Dense retrieval unavailable, using BM25 only: {str(e)}")
+                return []
+            norm = np.linalg.norm(query_vec)
+            query_vec = query_vec / norm if norm else query_vec
+            # Retrieval queries are built from templates and repeat often
+            if len(self._query_vectors) >= MAX_CACHED_QUERY_VECTORS:
+                self._query_vectors.clear()
+            self._query_vectors[query] = query_vec
+        if not query_vec.any():
+            return []
+        similarities = self._dense_vectors @ query_vec
+        return [int(i) for i in np.argsort(-similarities, kind='stable')[:k]]
+    
+    def _ensure_dense_vectors(self) -> bool:
+        """
+        Normalized corpus vectors for the dense leg
         
-        # Create source mapping
+        Only vectors compiled into the corpus artifact are used (python -m
+        rag.corpus --embedder ...); the knowledge base is never embedded
+        at query time.
+        """
+        if self._dense_vectors is not None:
+            return True
+        if not self._dense_available:
+            return False
+        corpus = self.corpus
+        if corpus.vectors is None:
+            self._dense_available = False
+            return False
+        try:
+            if self.embedder is None:
+                from rag.embedders import get_embedder
+                self.embedder = get_embedder(corpus.embedder_name)
+            if self.embedder.name != corpus.embedder_name:
+                raise ValueError(f"corpus vectors were compiled with '{corpus.embedder_name}', "
+                                 f"not '{self.embedder.name}'")
+            self._dense_vectors = corpus.derived(
+                f"dense_vectors:{corpus.embedder_name}", lambda: self._normalized_vectors(corpus.vectors)
+            )
+            return True
+        except Exception as e:
+            print(f"Dense retrieval unavailable, using BM25 only: {str(e)}")
+            self._dense_available = False
+            return False
+    
+    @staticmethod
+    def _normalized_vectors(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype='float32')
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+    
+    def _build_sources_map(self, top_chunks: List[Dict]) -> Dict[str, Dict]:
+        """Map S# ids to source metadata for the retrieved chunks"""
         sources_map = {}
         for i, chunk in enumerate(top_chunks, 1):
             source_id = f"S{i}"
@@ -257,7 +402,7 @@ class RAGPipeline:
                 'snippet': chunk['content'][:200] + '...' if len(chunk['content']) > 200 else chunk['content']
             }
         
-        return top_chunks, sources_map
+        return sources_map
     
     def format_sources_for_prompt(self, chunks: List[Dict]) -> str:
         """Format retrieved chunks for inclusion in prompt"""
@@ -291,12 +436,14 @@ class RAGPipeline:
     
     def get_fallback_sources(self) -> tuple[List[Dict], Dict[str, Dict]]:
         """Get fallback sources if retrieval fails"""
+        self._sync_corpus()
         
         # Return core NICE and NHS guidelines
-        fallback = [
-            chunk for chunk in self.knowledge_base
-            if chunk['source'] in ['NICE NG28', 'NHS']
-        ][:4]
+        with self._lock.read():
+            fallback = [
+                chunk for chunk in self.knowledge_base
+                if chunk['source'] in ['NICE NG28', 'NHS']
+            ][:4]
         
         sources_map = {}
         for i, chunk in enumerate(fallback, 1):
@@ -0,0 +1,28 @@
+"""
+Tests for token-aware chunking
+"""
+from rag.chunker import TokenChunker
+
+
+def _words(text: str) -> int:
+    return len(text.split())
+
+
+def _chunks(text: str, target_tokens: int, overlap_tokens: int = 0):
+    chunker = TokenChunker(target_tokens, overlap_tokens, counter=_words)
+    return [text[span.start:span.end] for span in chunker.spans(text)]
+
+
+def test_unpunctuated_last_sentence_stays_in_chunk():
+    text = "Body text after the heading. Another line of body text that goes on"
+    assert _chunks(text, 30) == [text]
+
+
+def test_list_items_are_body_text():
+    text = "Start metformin first.\n\n- Metformin 500 mg\n\n- Titrate weekly"
+    assert _chunks(text, 30) == [text]
+
+
+def test_markdown_heading_breaks_chunk_without_overlap():
+    text = "Intro sentence here.\n# Targets\nAim for 48 mmol/mol."
+    assert _chunks(text, 30, overlap_tokens=5) == ["Intro sentence here.", "# Targets\nAim for 48 mmol/mol."]
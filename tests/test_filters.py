@@ -0,0 +1,53 @@
+"""
+Tests for metadata filter compilation
+"""
+import numpy as np
+import pytest
+
+from rag.filters import FilterCompiler
+from rag.metadata_store import SQLiteMetadataStore, write_metadata_db
+
+ROWS = [
+    {"id": "a", "source": "NICE NG28", "updated": "2015-12-02", "tokens": 59},
+    {"id": "b", "source": "NICE NG17", "updated": "2022-08-17", "tokens": 137},
+    {"id": "c", "source": "NHS", "updated": "2023-01-10", "tokens": 100},
+    {"id": "d", "source": "NHS"},
+]
+
+
+def test_numeric_fields_compare_numerically():
+    compiler = FilterCompiler(ROWS)
+    assert compiler.compile({"tokens": {">=": 100}}).tolist() == [False, True, True, False]
+    assert compiler.compile({"tokens": {"<": 100}}).tolist() == [True, False, False, False]
+    assert compiler.compile({"tokens": 100}).tolist() == [False, False, True, False]
+    assert compiler.compile({"tokens": [59, 137]}).tolist() == [True, True, False, False]
+
+
+def test_date_strings_compare_in_order():
+    compiler = FilterCompiler(ROWS)
+    assert compiler.compile({"updated": {">=": "2022-01-01"}}).tolist() == [False, True, True, False]
+
+
+def test_membership_and_combined_conditions():
+    compiler = FilterCompiler(ROWS)
+    mask = compiler.compile({"source": {"NHS", "NICE NG17"}, "tokens": {">": 110}})
+    assert mask.tolist() == [False, True, False, False]
+
+
+def test_ordering_with_mismatched_operand_is_rejected():
+    compiler = FilterCompiler(ROWS)
+    with pytest.raises(ValueError):
+        compiler.compile({"source": {">": 3}})
+    with pytest.raises(ValueError):
+        compiler.compile({"tokens": {">": "many"}})
+
+
+def test_sqlite_store_reads_only_filtered_columns(tmp_path):
+    write_metadata_db(ROWS, str(tmp_path))
+    store = SQLiteMetadataStore(tmp_path / "metadata.sqlite")
+    assert store.column("tokens") == [59, 137, 100, None]
+    assert store.column("source") == ["NICE NG28", "NICE NG17", "NHS", "NHS"]
+
+    mask = FilterCompiler(store).compile({"tokens": {">=": 100}})
+    assert isinstance(mask, np.ndarray)
+    assert mask.tolist() == [False, True, True, False]
@@ -0,0 +1,40 @@
+"""
+Tests for the incremental top-level JSON parser
+"""
+import json
+
+import pytest
+
+from llm.json_stream import TopLevelJSONParser
+
+REPLY = {
+    "executive_summary": 'Tricky ,}{] text with "quotes" and a \\ backslash',
+    "interpretation": [{"problem": "HbA1c {high}", "citation_ids": ["S1"]}],
+    "diet_plan": {"principles": ["]not a close", "{not an open"], "hydration": "2 L, daily"},
+    "patient_goals": [],
+    "emr_note": "ends with an escaped quote \"",
+}
+
+
+def _feed(text: str, size: int):
+    parser = TopLevelJSONParser()
+    members = []
+    for i in range(0, len(text), size):
+        members.extend(parser.feed(text[i:i + size]))
+    return parser, members
+
+
+@pytest.mark.parametrize("size", [1, 3, 7])
+def test_members_survive_any_chunk_split(size):
+    text = "```json\n" + json.dumps(REPLY, indent=2) + "\n```"
+    parser, members = _feed(text, size)
+    assert parser.done
+    assert members == list(REPLY.items())
+
+
+@pytest.mark.parametrize("size", [1, 3, 7])
+def test_unfinished_object_is_not_done(size):
+    text = json.dumps(REPLY)[:-20]
+    parser, members = _feed(text, size)
+    assert not parser.done
+    assert [key for key, _ in members] == list(REPLY)[:len(members)]
@@ -0,0 +1,110 @@
+"""
+Tests for report repair and streaming in the report orchestrator
+"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from agents.report_cache import ReportCache
+from agents.report_orchestrator import ReportOrchestrator
+from llm.prompt_builder import PromptBuilder
+from rules import load_rules
+from rules.schemas.report import PatientIntake
+
+SNIPPETS = [{"id": "S1", "source": "NICE NG28", "section": "1.6", "text": "Offer metformin.",
+             "relevance_score": 0.9}]
+INTERPRETATION = [{"problem": "Glycaemia", "assessment": "Above target", "plan": "Review",
+                   "citation_ids": ["S1"]}]
+NARRATIVE = {
+    "executive_summary": "HbA1c above target.",
+    "clinical_context": {},
+    "interpretation": INTERPRETATION,
+    "lifestyle_plan": [{"text": "Walk daily", "citation_ids": ["S1"]}],
+    "diet_plan": {},
+    "monitoring_plan": {},
+    "patient_goals": ["Lower HbA1c"],
+    "medication_plan": [{"text": "Continue metformin", "citation_ids": ["S1"]}],
+    "follow_up": [],
+    "emr_note": "Reviewed.",
+    "citations": [{"id": "S1", "source": "NICE NG28", "section": "1.6"}],
+}
+
+
+class FakeClient:
+    """chat.completions.create returning queued replies, streamed in small pieces when asked"""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, stream=False, **options):
+        self.calls.append({"stream": stream, "messages": messages})
+        text = json.dumps(self.replies.pop(0))
+        if stream:
+            return [SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text[i:i + 5]))])
+                    for i in range(0, len(text), 5)]
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+def _orchestrator(tmp_path, replies) -> ReportOrchestrator:
+    orchestrator = ReportOrchestrator.__new__(ReportOrchestrator)
+    orchestrator.api_key = "sk-test"
+    orchestrator.client = FakeClient(replies)
+    orchestrator.mode = "single"
+    orchestrator.model = "gpt-4o-mini"
+    orchestrator.temperature = 0.2
+    orchestrator.max_tokens = 4000
+    orchestrator.repair_max_tokens = 1500
+    orchestrator.structured_output = False
+    orchestrator.rag_retriever = SimpleNamespace(build_retrieval_query=lambda patient: "query",
+                                                 retrieve=lambda query, k: list(SNIPPETS))
+    orchestrator.rules = load_rules()
+    orchestrator.report_cache = ReportCache(str(tmp_path / "reports.sqlite"))
+    orchestrator.prompt_builder = PromptBuilder()
+    return orchestrator
+
+
+@pytest.fixture
+def patient():
+    return PatientIntake(uuid="p1", name="Test Patient", dob="1960-01-01", sex="Male",
+                         diabetes_type="T2DM", height_cm=175, weight_kg=82,
+                         labs={"hba1c_pct": 8.1})
+
+
+def test_miscited_section_is_repaired_and_sent_once(tmp_path, patient):
+    miscited = {**NARRATIVE, "interpretation": [{**INTERPRETATION[0], "citation_ids": ["S9"]}]}
+    orchestrator = _orchestrator(tmp_path, [miscited, {"interpretation": INTERPRETATION}])
+
+    events = list(orchestrator.generate_report(patient, stream=True, use_cache=False))
+
+    sent = [event["value"] for event in events
+            if event["type"] == "section" and event["name"] == "interpretation"]
+    assert sent == [INTERPRETATION]
+    assert events[-1]["report"] is not None
+    assert events[-1]["report"].interpretation == INTERPRETATION
+    assert [call["stream"] for call in orchestrator.client.calls] == [True, False]
+
+
+def test_section_missing_after_repair_is_not_regenerated_when_streaming(tmp_path, patient):
+    incomplete = {name: value for name, value in NARRATIVE.items() if name != "medication_plan"}
+    orchestrator = _orchestrator(tmp_path, [incomplete, {}])
+
+    events = list(orchestrator.generate_report(patient, max_retries=1, stream=True, use_cache=False))
+
+    assert events[-1]["type"] == "report"
+    assert events[-1]["report"] is None
+    assert any("medication_plan" in error and "incomplete" in error for error in events[-1]["errors"])
+    assert [call["stream"] for call in orchestrator.client.calls] == [True, False]
+
+
+def test_section_missing_after_repair_is_not_regenerated(tmp_path, patient):
+    incomplete = {name: value for name, value in NARRATIVE.items() if name != "medication_plan"}
+    orchestrator = _orchestrator(tmp_path, [incomplete, {}])
+
+    report, errors = orchestrator.generate_report(patient, max_retries=1, use_cache=False)
+
+    assert report is None
+    assert not any(error.startswith("Attempt") for error in errors)
+    assert len(orchestrator.client.calls) == 2